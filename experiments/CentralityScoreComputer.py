@@ -1,19 +1,22 @@
 # coding: utf-8
+import os
 import numpy as np
 
 import sys
 sys.path.insert(0,"../python/")
 import centrality_utils.weight_funtions as wf 
 import centrality_utils.temporal_katz_computer as tkc
+import centrality_utils.sharded_temporal_katz_computer as stkc
 import centrality_utils.decayed_indegree_computer as dic
 import centrality_utils.temporal_pagerank as tprc
 import centrality_utils.static_pagerank_computer as sprc
 import centrality_utils.static_indegree_computer as sidc
 import centrality_utils.static_negative_beta_measure_computer as snbmc
 import centrality_utils.static_harmonic_centrality_computer as shcc
-from centrality_utils.base_computer import link2str
+from centrality_utils.node_registry import NodeRegistry
 import simulator_utils.graph_simulator as gsim
 from data_processing.tennis_player_processing import load_dataset_parameters
+from data_processing.dataset_cache import load_dataset
 
 # # 1. Load Parameters
 
@@ -30,35 +33,24 @@ print(delta, index_threshold)
 
 # # 2. Load Graph Data 
 
-data_path = '../data/%s_data/raw/%s_mentions.csv' % (dataset_id, dataset_id)
 score_output_dir = '../data/%s_data/centrality_measures/' % dataset_id
 
-data = np.loadtxt(data_path, delimiter=' ', dtype='i')
-print('%s dataset were loaded.' % dataset_id)
-print('Number of edges in data: %i.' % len(data))
+# the raw mention file is parsed only once: the edges after 'min_epoch' are cached in '../data/<dataset_id>_data/cache/'
+dataset = load_dataset(dataset_id, data_folder="../data")
 
-print(data[:5])
-
-# ## a.) exclude early information
-
-selector = data[:,0] >= min_epoch
-data = data[selector,:]
-print('Number of edges in data after excluding edges below epoch %i: %i.' % (min_epoch,len(data)))
-
-# ## b.) preprocessing nodes and edges
-
-src_unique = np.unique(data[:,1])
-trg_unique = np.unique(data[:,2])
-nodes = np.unique(np.concatenate((src_unique,trg_unique)))
-edges = [link2str(link) for link in data[:,1:3].tolist()] # element must be string to be hashable
-print(len(nodes), len(edges))
-
-print(edges[:3])
+print(dataset.get_edges(0,5))
 
 # # 3. Compute online centraliy measures
 
 # ## a.) Setting parameters
 
+# online computers share one node registry: nodes are registered when they first appear in the stream
+registry = NodeRegistry()
+
+# each computer is simulated in its own worker process, the static computers compute their snapshots in pipeline workers
+run_parallel = True
+pipeline_static = True
+
 tk_params, ttk_params, tpr_params, pr_params, indeg_params, nbm_params, hc_params = [], [], [], [], [], [], []
 gsim_params = []
 
@@ -77,12 +69,16 @@ else:
 # ### Select parameters for TemporalKatzComputer
 
 tk_beta = 1.0 # choose beta for temporal Katz centrality
+tk_shards = 1 # use more shard processes for very large node sets
 
 tk_params = []
 tk_params += [tkc.TemporalKatzParams(tk_beta,wf.ExponentialWeighter(base=0.5,norm=n)) for n in norm_factors]
 
 if len(tk_params) > 0:
-    gsim_params.append(tkc.TemporalKatzComputer(nodes,tk_params))
+    if tk_shards > 1:
+        gsim_params.append(stkc.ShardedTemporalKatzComputer(None,tk_params,num_of_shards=tk_shards,use_landmark=True,registry=registry))
+    else:
+        gsim_params.append(tkc.TemporalKatzComputer(None,tk_params,use_landmark=True,registry=registry))
 
 
 # ### Select parameters for TruncatedTemporalKatzComputer
@@ -91,14 +87,14 @@ ttk_params = []
 ttk_params += [tkc.TruncatedTemporalKatzParams(tk_beta,wf.ExponentialWeighter(base=0.5,norm=n)) for n in norm_factors]
 
 if len(ttk_params) > 0:
-    gsim_params.append(tkc.TruncatedTemporalKatzComputer(nodes,ttk_params,k=5))
+    gsim_params.append(tkc.TruncatedTemporalKatzComputer(None,ttk_params,k=5,use_landmark=True,registry=registry))
 
 # ### Select parameters for TemporalPageRankComputer
 
 tpr_params += [tprc.TemporalPageRankParams(0.85,b) for b in [0.001,0.01,0.05,0.1,0.3,0.5,0.9]] 
 
 if len(tpr_params) > 0:
-    gsim_params.append(tprc.TemporalPageRankComputer(nodes,tpr_params))
+    gsim_params.append(tprc.TemporalPageRankComputer(None,tpr_params,registry=registry))
 
 
 # ### Select parameters for StaticPageRankComputer
@@ -123,6 +119,13 @@ nbm_params += [snbmc.StaticNegativeBetaMeasureParams(lookback_cnt=l) for l in st
 if len(nbm_params) > 0:
     gsim_params.append(snbmc.StaticNegativeBetaMeasureComputer(nbm_params))
 
+# ### Select parameters for OnlineIndegreeComputer
+
+did_params = []
+did_params += [dic.DecayedIndegreeParams(wf.ExponentialWeighter(base=0.5,norm=n)) for n in norm_factors]
+
+gsim_params.append(dic.DecayedIndegreeComputer(None,None,did_params,min_time=min_epoch,registry=registry))
+
 # ### Select parameters for StaticHarmonicCentralityComputer
 
 #exclude computation on the total graph
@@ -133,20 +136,22 @@ for l in static_lookbacks:
         hc_params.append(shcc.StaticHarmonicCentralityParams(lookback_cnt=l))
 
 if len(hc_params) > 0:
-    gsim_params.append(shcc.StaticHarmonicCentralityComputer(hc_params))
-
-# ### Select parameters for OnlineIndegreeComputer
-
-did_params = []
-did_params += [dic.DecayedIndegreeParams(wf.ExponentialWeighter(base=0.5,norm=n)) for n in norm_factors]
-
-gsim_params.append(dic.DecayedIndegreeComputer(nodes,edges,did_params,min_time=min_epoch))
+    if run_parallel or pipeline_static:
+        # the other computers (and the static pipeline) already run in their own worker processes, so do the temporal Katz shards
+        hc_processes = max(1, os.cpu_count() - len(gsim_params) - (tk_shards if tk_shards > 1 else 0))
+    else:
+        hc_processes = os.cpu_count()
+    # BFS sources are shared among the remaining cores
+    gsim_params.append(shcc.StaticHarmonicCentralityComputer(hc_params,num_of_processes=hc_processes))
 
 # ## b.) Compute all online scores with one graph simulation
 
 boundaries = min_epoch + np.array([delta*i for i in range(1,index_threshold+1)])
 
-gsim_obj = gsim.OnlineGraphSimulator(data, time_type="epoch", verbose=True)
-nexperiment_graph_stats = gsim_obj.run_with_boundaries(gsim_params,boundaries,score_output_dir,max_index=index_threshold)
+gsim_obj = gsim.OnlineGraphSimulator(time_type="epoch", verbose=True, snapshot_format="binary", write_threads=1, pipeline_static=pipeline_static)
+if run_parallel:
+    nexperiment_graph_stats = gsim_obj.run_in_parallel(gsim_params,boundaries,score_output_dir,max_index=index_threshold,edge_chunks=dataset.iter_edge_chunks())
+else:
+    nexperiment_graph_stats = gsim_obj.run_with_boundaries(gsim_params,boundaries,score_output_dir,max_index=index_threshold,edge_chunks=dataset.iter_edge_chunks())
 
 print("Done")
\ No newline at end of file
@@ -0,0 +1,85 @@
+# coding: utf-8
+import os, time
+import numpy as np
+import pandas as pd
+from scipy.stats import spearmanr, kendalltau
+
+import sys
+sys.path.insert(0,"../python/")
+from centrality_utils.harmonic_centrality import harmonic_centrality, hyperball_harmonic_centrality
+from simulator_utils.graph_extractor import EdgeWindow
+from data_processing.tennis_player_processing import load_dataset_parameters
+from data_processing.dataset_cache import load_dataset
+
+# # 1. Load Parameters
+
+# ### Works only after downloading the tennis player datasets!
+
+dataset_ids = ["rg17", "uo17"]
+delta = 3600
+lookbacks = [1, 6, 24]
+register_counts = [16, 32, 64, 128, 256]
+# evaluate every 'snapshot_step'-th snapshot
+snapshot_step = 12
+top_k = 50
+num_of_processes = os.cpu_count()
+
+def top_k_precision(exact, approx, k):
+    k = min(k, len(exact))
+    if k == 0:
+        return 1.0
+    return len(set(np.argsort(-exact)[:k]).intersection(np.argsort(-approx)[:k])) / float(k)
+
+# # 2. Compare exact and approximate harmonic centrality on the windowed graphs
+
+results = []
+for dataset_id in dataset_ids:
+    min_epoch, num_days, _, _, _, _ = load_dataset_parameters(dataset_id)
+    dataset = load_dataset(dataset_id, data_folder="../data")
+    boundaries = min_epoch + delta * np.arange(1, int(num_days * 86400 / delta) + 1)
+    edge_window = EdgeWindow(lookbacks)
+    # edges up to each boundary
+    boundary_offsets = np.searchsorted(dataset.time, boundaries, side="right")
+    start_idx = 0
+    for snapshot_id, end_idx in enumerate(boundary_offsets):
+        for src, trg in zip(dataset.src[start_idx:end_idx].tolist(), dataset.trg[start_idx:end_idx].tolist()):
+            edge_window.add_edge(src, trg)
+        start_idx = end_idx
+        edge_window.close_snapshot()
+        edge_window.clear()
+        if (snapshot_id+1) % snapshot_step != 0:
+            continue
+        for lookback_cnt in lookbacks:
+            view = edge_window.get_view(lookback_cnt)
+            if len(view) == 0:
+                continue
+            adjacency = view.to_scipy()
+            start_time = time.time()
+            exact = harmonic_centrality(adjacency, num_of_processes=num_of_processes)
+            exact_time = time.time() - start_time
+            for num_of_registers in register_counts:
+                start_time = time.time()
+                approx = hyperball_harmonic_centrality(adjacency, num_of_registers=num_of_registers, node_keys=view.node_ids)
+                approx_time = time.time() - start_time
+                results.append({
+                    "dataset":dataset_id, "snapshot_id":snapshot_id, "lookback_cnt":lookback_cnt,
+                    "num_of_registers":num_of_registers, "num_of_nodes":len(view), "num_of_edges":view.num_of_edges(),
+                    "spearman":spearmanr(exact, approx)[0], "kendall":kendalltau(exact, approx)[0],
+                    "top_%i_precision" % top_k:top_k_precision(exact, approx, top_k),
+                    "exact_time":exact_time, "approx_time":approx_time
+                })
+        print("%s: snapshot %i was evaluated" % (dataset_id, snapshot_id))
+
+# # 3. Summary
+
+results_df = pd.DataFrame(results)
+summary_df = results_df.groupby(["dataset","lookback_cnt","num_of_registers"])[["spearman","kendall","top_%i_precision" % top_k,"exact_time","approx_time"]].mean()
+summary_df["speedup"] = summary_df["exact_time"] / summary_df["approx_time"]
+print(summary_df)
+
+output_dir = "../results/harmonic_centrality_benchmark"
+if not os.path.exists(output_dir):
+    os.makedirs(output_dir)
+results_df.to_csv("%s/hyperball_vs_exact.csv" % output_dir, index=False)
+summary_df.to_csv("%s/hyperball_vs_exact_summary.csv" % output_dir)
+print("Done")
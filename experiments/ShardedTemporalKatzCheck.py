@@ -0,0 +1,43 @@
+# coding: utf-8
+import numpy as np
+
+import sys
+sys.path.insert(0,"../python/")
+import centrality_utils.weight_funtions as wf
+import centrality_utils.temporal_katz_computer as tkc
+import centrality_utils.sharded_temporal_katz_computer as stkc
+
+# # 1. Synthetic edge stream
+
+# few nodes and small batches: the sources of the edges between shards are updated again in the same batch
+num_of_nodes = 300
+num_of_edges = 6000
+num_of_shards = 3
+batch_size = 777
+# compare the scores after every 'snapshot_step' edges
+snapshot_step = 1000
+
+rnd = np.random.RandomState(0)
+times = 1000000 + np.sort(rnd.randint(0, 12*1800, size=num_of_edges))
+edges = rnd.randint(0, num_of_nodes, size=(num_of_edges,2))
+tk_params = [tkc.TemporalKatzParams(0.7,wf.ExponentialWeighter(base=0.5,norm=n)) for n in [600.0, 3600.0]]
+
+# # 2. Compare the sharded and the sequential temporal Katz scores
+
+for use_landmark in [False, True]:
+    computer = tkc.TemporalKatzComputer(None,tk_params,use_landmark=use_landmark)
+    sharded_computer = stkc.ShardedTemporalKatzComputer(None,tk_params,num_of_shards=num_of_shards,use_landmark=use_landmark,batch_size=batch_size)
+    try:
+        for edge_idx, (time, src, trg) in enumerate(zip(times.tolist(), edges[:,0].tolist(), edges[:,1].tolist())):
+            computer.update((src,trg), time)
+            sharded_computer.update((src,trg), time)
+            if (edge_idx+1) % snapshot_step == 0 or edge_idx == num_of_edges-1:
+                scores = computer.get_all_updated_node_ranks(time)
+                sharded_scores = sharded_computer.get_all_updated_node_ranks(time)
+                if not np.array_equal(scores, sharded_scores):
+                    raise RuntimeError("Sharded scores differ after %i edges (use_landmark=%s)!" % (edge_idx+1, use_landmark))
+    finally:
+        sharded_computer.close()
+    print("use_landmark=%s: the sharded scores are the same" % use_landmark)
+
+print("Done")
@@ -1,5 +1,9 @@
+import os, threading
+from collections import deque
+import numpy as np
 import pandas as pd
 import networkx as nx
+from .snapshot_format import get_snapshot_path, write_score_snapshot
 
 def link2str(link):
     return str((int(link[0]),int(link[1])))
@@ -9,24 +13,222 @@ def scores2file(score_map,output_file):
     score_df = pd.DataFrame(score_map,columns=["node_id","score"])
     score_df.to_csv(output_file,sep=" ",header=False,index=False)
 
-def get_graph_from_snapshots(comp, new_snapshot_graph, param, idx):
-    """Aggregate multiple graph snapshots. Needed for static PageRank and Indegree."""
-    comp.graph_snapshots[idx].append(list(new_snapshot_graph.edges()))
-    while len(comp.graph_snapshots[idx]) > param.lookback_cnt:
-        comp.graph_snapshots[idx].popleft()
-    #print(len(new_snapshot_graph.edges()), len(comp.graph_snapshots[idx]))
-    U = nx.DiGraph()
-    for e_list in comp.graph_snapshots[idx]:
-        #print(len(e_list))
-        U.add_edges_from(e_list)
-    #print(param.lookback_cnt, len(U.edges()))
-    return U    
+# graph structures that the simulator maintains on demand (see 'BaseComputer.get_graph_requirements')
+SNAPSHOT_EDGES = "snapshot_edges"
+FULL_GRAPH = "full_graph"
+EDGE_WINDOW = "edge_window"
+
+def init_window_scores(snapshot_graph, param_list):
+    """Return the edge window views of the parameters, the rows of their nodes and a zero (nodes x 1+params) matrix. The first column of the matrix holds the sorted identifiers of the nodes of every view."""
+    views = [snapshot_graph.get_view(param.lookback_cnt) for param in param_list]
+    node_ids = np.unique(np.concatenate([view.node_ids for view in views])) if len(views) > 0 else np.zeros(0, dtype=np.int64)
+    scores = np.zeros((len(node_ids),1+len(param_list)))
+    scores[:,0] = node_ids
+    rows = [np.searchsorted(node_ids, view.node_ids) for view in views]
+    return views, rows, scores
+
+class ScoreSnapshot():
+    """Scores of a computer at a snapshot boundary. 'scores' is a (nodes x columns) matrix, the column names are the parameter strings (they name the output folders of the legacy .csv format). Set 'positive_only' to export only the nodes with positive score for each column."""
+    def __init__(self,file_prefix,node_ids,scores,columns,positive_only=False):
+        self.file_prefix = file_prefix
+        self.node_ids = node_ids
+        self.scores = np.asarray(scores).reshape(len(node_ids),len(columns))
+        self.columns = [str(col) for col in columns]
+        self.positive_only = positive_only
+        
+    def freeze(self):
+        """Return a copy that does not share memory with the arrays of the computer"""
+        return ScoreSnapshot(self.file_prefix,np.array(self.node_ids),np.array(self.scores),self.columns,positive_only=self.positive_only)
+
+class SnapshotWriter():
+    """Base class of the snapshot writers. Synchronous writers have finished every write when 'write' returns."""
+    def write(self,snapshot,experiment_folder,snapshot_index):
+        pass
+    
+    def get_ticket(self):
+        """Identifier of the writes submitted so far (see 'wait')"""
+        return None
+    
+    def wait(self,ticket=None):
+        """Block until the writes of the ticket (or every submitted write) are on disk"""
+        pass
     
+    def close(self):
+        self.wait()
+
+class CsvSnapshotWriter(SnapshotWriter):
+    """Legacy output: one '<experiment_folder>/<column>/<file_prefix>_<snapshot_index>.csv' file for each column"""
+    def write(self,snapshot,experiment_folder,snapshot_index):
+        for j, column in enumerate(snapshot.columns):
+            output_folder = "%s/%s" % (experiment_folder,column)
+            # several writer threads may create the folder at once
+            os.makedirs(output_folder, exist_ok=True)
+            values = snapshot.scores[:,j]
+            rows = values > 0 if snapshot.positive_only else slice(None)
+            active_arr = np.column_stack((snapshot.node_ids[rows],values[rows]))
+            scores2file(active_arr,"%s/%s_%i.csv" % (output_folder,snapshot.file_prefix,snapshot_index))
+
+class BinarySnapshotWriter(SnapshotWriter):
+    """Columnar output: one '<experiment_folder>/<file_prefix>_<snapshot_index>.bin' file for each computer (see snapshot_format.py)"""
+    def write(self,snapshot,experiment_folder,snapshot_index):
+        os.makedirs(experiment_folder, exist_ok=True)
+        file_path = get_snapshot_path(experiment_folder,snapshot.file_prefix,snapshot_index)
+        write_score_snapshot(file_path,snapshot.node_ids,snapshot.scores,snapshot.columns,positive_only=snapshot.positive_only)
+
+class AsyncSnapshotWriter(SnapshotWriter):
+    """Serialize snapshots with 'num_of_threads' background threads using the wrapped writer. 'write' only freezes a copy of the scores and blocks if 'max_pending' snapshots are already waiting (backpressure). Call 'close' (or 'wait') as a barrier before reading the files. Errors of the background threads are raised by the next 'write', 'wait' or 'close' call."""
+    def __init__(self,writer,num_of_threads=1,max_pending=4):
+        if num_of_threads < 1 or max_pending < 1:
+            raise RuntimeError("'num_of_threads' and 'max_pending' must be positive!")
+        self.writer = writer
+        self.num_of_threads = num_of_threads
+        self.max_pending = max_pending
+        self.condition = threading.Condition()
+        self.tasks = deque([])
+        self.pending_tickets = set()
+        self.last_ticket = 0
+        self.error = None
+        self.threads = []
+        
+    def _start_threads(self):
+        if len(self.threads) == 0:
+            for i in range(self.num_of_threads):
+                thread = threading.Thread(target=self._run, name="snapshot-writer-%i" % i)
+                thread.daemon = True
+                thread.start()
+                self.threads.append(thread)
+        
+    def _raise_error(self):
+        if self.error != None:
+            error, self.error = self.error, None
+            raise error
+        
+    def _run(self):
+        while True:
+            with self.condition:
+                while len(self.tasks) == 0:
+                    self.condition.wait()
+                task = self.tasks.popleft()
+                self.condition.notify_all()
+            if task == None:
+                return
+            ticket, snapshot, experiment_folder, snapshot_index = task
+            try:
+                self.writer.write(snapshot,experiment_folder,snapshot_index)
+            except Exception as e:
+                with self.condition:
+                    if self.error == None:
+                        self.error = e
+            with self.condition:
+                self.pending_tickets.discard(ticket)
+                self.condition.notify_all()
+        
+    def write(self,snapshot,experiment_folder,snapshot_index):
+        snapshot = snapshot.freeze()
+        with self.condition:
+            self._raise_error()
+            self._start_threads()
+            while len(self.tasks) >= self.max_pending:
+                self.condition.wait()
+            self.last_ticket += 1
+            self.pending_tickets.add(self.last_ticket)
+            self.tasks.append((self.last_ticket,snapshot,experiment_folder,snapshot_index))
+            self.condition.notify_all()
+        
+    def get_ticket(self):
+        with self.condition:
+            return self.last_ticket
+        
+    def wait(self,ticket=None):
+        with self.condition:
+            ticket = self.last_ticket if ticket == None else ticket
+            while len(self.pending_tickets) > 0 and min(self.pending_tickets) <= ticket:
+                self.condition.wait()
+            self._raise_error()
+        
+    def close(self):
+        """Wait for every pending write and stop the threads. The threads are restarted by the next 'write'."""
+        try:
+            self.wait()
+        finally:
+            with self.condition:
+                self.tasks.extend([None] * len(self.threads))
+                self.condition.notify_all()
+            for thread in self.threads:
+                thread.join()
+            self.threads = []
+
+SNAPSHOT_WRITERS = {"csv":CsvSnapshotWriter, "binary":BinarySnapshotWriter}
+
+def get_snapshot_writer(snapshot_format,num_of_threads=0,max_pending=4):
+    """Return the writer of the snapshot format. It is wrapped into an AsyncSnapshotWriter if 'num_of_threads' is positive."""
+    if not snapshot_format in SNAPSHOT_WRITERS:
+        raise RuntimeError("Invalid snapshot format: %s. Choose from %s!" % (snapshot_format, sorted(SNAPSHOT_WRITERS.keys())))
+    writer = SNAPSHOT_WRITERS[snapshot_format]()
+    if num_of_threads > 0:
+        writer = AsyncSnapshotWriter(writer,num_of_threads=num_of_threads,max_pending=max_pending)
+    return writer
+
 class BaseComputer():
+    # the legacy .csv output is the default, use 'set_snapshot_writer' to change it
+    snapshot_writer = CsvSnapshotWriter()
+    # computers that set it to True receive the edges of one timestamp as distinct (src,trg) pairs with multiplicities in the coalesced simulation mode
+    coalescable = False
+    # computers that set it to True compute their scores only at snapshot time from the EDGE_WINDOW, so the simulator can compute their snapshots in worker processes (see StaticPipeline)
+    pipelinable = False
+
+    def __getstate__(self):
+        """Synchronous snapshot writers are copied to worker processes. The threads of an AsyncSnapshotWriter stay in the process of the simulator, so copies use its wrapped writer (the file format is the same)."""
+        state = dict(self.__dict__)
+        if isinstance(state.get("snapshot_writer"), AsyncSnapshotWriter):
+            state["snapshot_writer"] = state["snapshot_writer"].writer
+        return state
+
+    def copy_state(self,computer):
+        """Take over the state of a copy of this computer (e.g. from a worker process) except its snapshot writer"""
+        state = dict(computer.__dict__)
+        state.pop("snapshot_writer", None)
+        self.__dict__.update(state)
+
+    def get_graph_requirements(self):
+        """Return the graph structures that the computer reads: SNAPSHOT_EDGES (edges of the current snapshot), FULL_GRAPH (networkx graph of every edge) or EDGE_WINDOW (views of the last snapshots, see 'get_lookback_counts'). The simulator passes None instead of the structures that no computer requires."""
+        return set([SNAPSHOT_EDGES, FULL_GRAPH])
     
+    def get_lookback_counts(self):
+        """Return the numbers of snapshots that the computer reads from the EDGE_WINDOW ('lookback_cnt'=0 means the total graph). The 'snapshot_graph' is then an EdgeWindow shared by every computer."""
+        return []
+
+    def reads_snapshot_files(self):
+        """Return True if the computer reads the snapshot files of other computers when it saves its own snapshot"""
+        return False
+
     def update(self,edge,time=None,graph=None,snapshot_graph=None):
         pass
     
+    def update_many(self,src_ids,trg_ids,time=None,graph=None,snapshot_graph=None):
+        """Process several edges with the same timestamp in the given order. Computers may override it with a faster batch update."""
+        for src, trg in zip(src_ids,trg_ids):
+            self.update((src,trg),time=time,graph=graph,snapshot_graph=snapshot_graph)
+    
+    def update_coalesced(self,src_ids,trg_ids,multiplicities,time=None,graph=None,snapshot_graph=None):
+        """Process the distinct edges of one timestamp with their multiplicities. Coalescable computers override it with a closed form update."""
+        for src, trg, multiplicity in zip(src_ids,trg_ids,multiplicities):
+            for _ in range(int(multiplicity)):
+                self.update((src,trg),time=time,graph=graph,snapshot_graph=snapshot_graph)
+    
+    def get_snapshot(self,time=None,graph=None,snapshot_graph=None):
+        """Return the current scores as a ScoreSnapshot (None if the computer has nothing to export)"""
+        return None
+    
+    def set_snapshot_writer(self,snapshot_writer):
+        self.snapshot_writer = snapshot_writer
+    
     def save_snapshot(self,experiment_folder,snapshot_index,time=None,graph=None,snapshot_graph=None):
+        snapshot = self.get_snapshot(time=time,graph=graph,snapshot_graph=snapshot_graph)
+        if snapshot != None:
+            self.snapshot_writer.write(snapshot,experiment_folder,snapshot_index)
+    
+    def close(self):
+        """Stop the worker processes of the computer (if any). The simulator calls it at the end of each run, the workers are started again on demand."""
         pass
     
\ No newline at end of file
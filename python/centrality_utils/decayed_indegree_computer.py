@@ -1,7 +1,10 @@
 import sys, os
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from .base_computer import *
 from .weight_funtions import *
+from .node_registry import NodeRegistry, NodeActivity
+from .edge_index import EdgeIndex
 
 sys.path.insert(0,"../")
 from evaluation_utils.eval_utils import load_score_map
@@ -19,89 +22,138 @@ class DecayedIndegreeParams():
             return "did_%s" % str(self.weight_func)
         
 class DecayedIndegreeComputer(BaseComputer):
-    """Indegree with time decay function"""
-    def __init__(self,nodes,edges,param_list,min_time=0,storage_ratio=1.8):
+    """Indegree with time decay function. 'nodes' and 'edges' can be None: unseen nodes and edges are registered on arrival. If 'edges' is given then the edge storage is presized to 'storage_ratio' times its length."""
+    coalescable = True
+    
+    def __init__(self,nodes,edges,param_list,min_time=0,storage_ratio=1.8,registry=None):
         self.param_list = param_list
-        self.num_of_nodes, self.num_of_edges = len(nodes), len(edges)
-        self.node_indexes, self.edge_indexes = dict(zip(nodes,range(self.num_of_nodes))), dict(zip(edges,range(self.num_of_edges)))
-        self.online_ranks = np.zeros((self.num_of_nodes,len(self.param_list)))
-        self.node_last_activation = {}
-        stored_num_of_edges = int(np.ceil(self.num_of_edges * storage_ratio))
-        self.max_edge_index = len(edges)
-        self.edge_weights = np.zeros((stored_num_of_edges,len(self.param_list)))
-        self.edge_last_activation = np.ones(stored_num_of_edges) * min_time
-        self.batch_score_maps = [None for i in range(len(self.param_list))]
-        self.batch_score_mins = [0.0 for i in range(len(self.param_list))]
+        self.registry = NodeRegistry() if registry == None else registry
+        if nodes is not None:
+            self.registry.add_nodes(nodes)
+        self.node_indexes = self.registry.node_indexes
+        self.node_last_activation = NodeActivity(self.registry)
+        self.min_time = min_time
+        initial_capacity = 1024 if edges is None else int(np.ceil(len(edges) * storage_ratio))
+        self.edge_index = EdgeIndex(initial_capacity, track_incoming=True)
+        self.edge_last_activation = self.edge_index.allocate(fill_value=min_time)
+        # node-indexed batch scores ('batch_score_fill' is used for missing nodes)
+        self.batch_score_fill = np.ones(len(self.param_list))
+        self.batch_scores = self.registry.allocate(len(self.param_list), fill_value=1.0)
+        self.pending_batch_scores = {}
+        self.batch_loader = None
+        self.weight_bank = WeightBank(self.param_list)
+        
+    def __getstate__(self):
+        """Pending batch scores are applied before the computer is copied to another process, the loader thread is not copied"""
+        self.apply_loaded_batch_scores()
+        state = BaseComputer.__getstate__(self)
+        state["batch_loader"] = None
+        return state
+
+    def fit_node_arrays(self):
+        if len(self.batch_scores) < self.registry.capacity:
+            self.node_last_activation.fit()
+            batch_scores = np.tile(self.batch_score_fill, (self.registry.capacity,1))
+            batch_scores[:len(self.batch_scores)] = self.batch_scores
+            self.batch_scores = batch_scores
+    
+    def get_node_index(self,node_id):
+        node_index = self.registry.get_index(node_id)
+        if node_index >= len(self.batch_scores):
+            self.fit_node_arrays()
+        return node_index
+    
+    def get_edge_slot(self,src_index,trg_index):
+        edge_slot = self.edge_index.get_slot(src_index,trg_index)
+        if edge_slot >= len(self.edge_last_activation):
+            self.edge_last_activation = self.edge_index.fit(self.edge_last_activation, fill_value=self.min_time)
+        return edge_slot
         
     def get_updated_node_rank(self,time,graph,node_id):
-        node_index = self.node_indexes[node_id]
-        # drop multi-edge instances
-        hashed_in_edges = [link2str(link) for link in set(graph.in_edges(nbunch=[node_id]))]
-        olr_values = np.zeros(len(self.param_list))
-        #num_found = 0
-        for h_in_edge in hashed_in_edges:
-            edge_index = self.edge_indexes[h_in_edge]  
-            time_last_activation = self.edge_last_activation[edge_index]
-            delta_time = time - time_last_activation
-            time_decaying_weights, batch_scores = [], []
-            for idx, param in enumerate(self.param_list):
-                time_decaying_weights.append(param.weight_func.weight(delta_time))
-                if self.batch_score_maps[idx] is not None:
-                    src, _ = str2link(h_in_edge)
-                    if float(src) in self.batch_score_maps[idx]:
-                        batch_scores.append(self.batch_score_maps[idx][float(src)])
-                        #num_found += 1
-                    else:
-                        batch_scores.append(self.batch_score_mins[idx])
-                else:
-                    batch_scores.append(1.0)
-            olr_values += np.array(batch_scores) * time_decaying_weights
-        #print("Num found: %i" % num_found)
+        self.apply_loaded_batch_scores()
+        node_index = self.get_node_index(node_id)
+        # each in-edge has exactly one slot (multi-edge instances are dropped)
+        edge_slots = self.edge_index.get_incoming_slots(node_index)
+        if len(edge_slots) == 0:
+            return node_index, np.zeros(len(self.param_list))
+        time_decaying_weights = self.weight_bank.weights(time - self.edge_last_activation[edge_slots])
+        batch_scores = self.batch_scores[self.edge_index.edge_src[edge_slots]]
+        olr_values = (batch_scores * time_decaying_weights).sum(axis=0)
         return node_index, olr_values # return updated ranks for scource node
 
-    def get_all_updated_node_ranks(self,time,graph):
-        updated_scores = []
-        for node in self.node_last_activation:
-            node_index = self.node_indexes[node]
-            node_index, node_rank = self.get_updated_node_rank(time,graph,node)
-            row = [node] + list(node_rank)
-            updated_scores.append(row)
-        return np.array(updated_scores)
+    def get_all_updated_node_ranks(self,time,graph=None):
+        """Recompute the score of every active node with one segment sum over the edge slots. The batch scores of the last snapshot are applied first."""
+        self.apply_loaded_batch_scores()
+        num_of_edges, num_of_nodes = len(self.edge_index), len(self.registry)
+        edge_src, edge_trg = self.edge_index.edge_src[:num_of_edges], self.edge_index.edge_trg[:num_of_edges]
+        edge_values = self.batch_scores[edge_src] * self.weight_bank.weights(time - self.edge_last_activation[:num_of_edges])
+        all_ranks = np.zeros((num_of_nodes,len(self.param_list)))
+        for j in range(len(self.param_list)):
+            all_ranks[:,j] = np.bincount(edge_trg, weights=edge_values[:,j], minlength=num_of_nodes)
+        node_indices = self.node_last_activation.get_active_indices()
+        return np.column_stack((self.registry.get_node_ids(node_indices).astype(np.float64),all_ranks[node_indices]))
 
+    def get_graph_requirements(self):
+        return set()
+        
     def update(self,edge,time,graph,snapshot_graph=None):
         src, trg = int(edge[0]), int(edge[1])
-        self.node_last_activation[src] = time
-        self.node_last_activation[trg] = time
-        hashed_edge = link2str(edge)
-        try:
-            edge_index = self.edge_indexes[hashed_edge]
-        except:
-            if self.max_edge_index > len(self.edge_weights):
-                raise RuntimeError("Cannot store more edge!!!")
-            edge_index = self.max_edge_index
-            self.edge_indexes[hashed_edge] = edge_index
-            self.max_edge_index += 1
-        src_node_index, src_updated_ranks = self.get_updated_node_rank(time,graph,src)
-        self.online_ranks[src_node_index,:] = src_updated_ranks
-        self.edge_weights[edge_index,:] = src_updated_ranks
-        self.edge_last_activation[edge_index] = time
+        src_index, trg_index = self.get_node_index(src), self.get_node_index(trg)
+        self.node_last_activation.activate(src_index,time)
+        self.node_last_activation.activate(trg_index,time)
+        # the scores are computed from the last activation of the edges at snapshot time
+        edge_slot = self.get_edge_slot(src_index,trg_index)
+        self.edge_last_activation[edge_slot] = time
         
-    def save_snapshot(self,experiment_folder,snapshot_index,time,graph,snapshot_graph=None):
-        if not os.path.exists(experiment_folder):
-            os.makedirs(experiment_folder)
+    def update_coalesced(self,src_ids,trg_ids,multiplicities,time=None,graph=None,snapshot_graph=None):
+        """Update with the distinct edges of one timestamp. Multiplicities are ignored as multi-edge instances are dropped. The exported scores only depend on the last activation of the edges, so they are identical to sequential processing."""
+        # endpoints are registered in the same order as in sequential processing
+        edge_indices = np.array([(self.get_node_index(int(src)),self.get_node_index(int(trg))) for src, trg in zip(src_ids,trg_ids)], dtype=np.int64).reshape(-1,2)
+        src_indices, trg_indices = edge_indices[:,0], edge_indices[:,1]
+        self.node_last_activation.activate(src_indices,time)
+        self.node_last_activation.activate(trg_indices,time)
+        edge_slots = np.array([self.get_edge_slot(src_index,trg_index) for src_index, trg_index in zip(src_indices,trg_indices)], dtype=np.int64)
+        self.edge_last_activation[edge_slots] = time
+        
+    def get_snapshot(self,time=None,graph=None,snapshot_graph=None):
         all_nodes_updated = self.get_all_updated_node_ranks(time,graph)
+        return ScoreSnapshot("did",all_nodes_updated[:,0],all_nodes_updated[:,1:],self.param_list)
+        
+    def reads_snapshot_files(self):
+        """The batch scores are loaded from the snapshot files of other computers"""
+        return any(param.batch_score_part != "" for param in self.param_list)
+
+    def save_snapshot(self,experiment_folder,snapshot_index,time,graph,snapshot_graph=None):
+        BaseComputer.save_snapshot(self,experiment_folder,snapshot_index,time=time,graph=graph,snapshot_graph=snapshot_graph)
         for j, param in enumerate(self.param_list):
-            output_folder = "%s/%s" % (experiment_folder, param)
-            if not os.path.exists(output_folder):
-                os.makedirs(output_folder)
-            active_arr = all_nodes_updated[:,[0,j+1]]
-            scores2file(active_arr,"%s/did_%i.csv" % (output_folder,snapshot_index))
             self.load_centrality_for_next_interval(j, param, snapshot_index, experiment_folder)
             
     def load_centrality_for_next_interval(self, param_idx, param, snapshot_index, score_root_dir):
+        """Start loading the batch scores of the next interval in the background. They are applied when the next snapshot is taken, so the load overlaps with the edges of the interval."""
         if param.batch_score_part != "":
+            if self.batch_loader == None:
+                self.batch_loader = ThreadPoolExecutor(max_workers=1)
             file_prefix = "%s/%s" % (score_root_dir, param.batch_score_part)
-            scores_df = load_score_map(file_prefix, snapshot_index).reset_index()
-            score_dict = dict(zip(scores_df["id"],scores_df["score"]))
-            self.batch_score_maps[param_idx] = score_dict
-            self.batch_score_mins[param_idx] = min(score_dict.values())
+            # the batch score file may still be in the queue of an asynchronous snapshot writer
+            ticket = self.snapshot_writer.get_ticket()
+            self.pending_batch_scores[param_idx] = self.batch_loader.submit(self.load_batch_scores, file_prefix, snapshot_index, ticket)
+            
+    def load_batch_scores(self, file_prefix, snapshot_index, ticket=None):
+        """Wait for the snapshot writes of the ticket, then load the batch scores. The batch score computer must share the snapshot writer of this computer."""
+        self.snapshot_writer.wait(ticket)
+        return load_score_map(file_prefix, snapshot_index)
+            
+    def apply_loaded_batch_scores(self):
+        """Wait for the pending batch score files and copy them into the node-indexed score vectors"""
+        for param_idx in sorted(self.pending_batch_scores.keys()):
+            scores_df = self.pending_batch_scores[param_idx].result().reset_index()
+            if len(scores_df) == 0:
+                raise RuntimeError("Batch score file is empty for parameter '%s'!" % self.param_list[param_idx])
+            self.fit_node_arrays()
+            self.batch_score_fill[param_idx] = scores_df["score"].min()
+            self.batch_scores[:,param_idx] = self.batch_score_fill[param_idx]
+            # every source of the edges is registered at snapshot time, unknown nodes of the file (e.g. nodes of other computers) are ignored
+            node_indices = np.array([self.node_indexes.get(node_id, -1) for node_id in scores_df["id"].values.astype(np.int64).tolist()], dtype=np.int64)
+            is_known = node_indices >= 0
+            self.batch_scores[node_indices[is_known],param_idx] = scores_df["score"].values[is_known]
+        self.pending_batch_scores = {}
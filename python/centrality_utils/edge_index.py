@@ -0,0 +1,75 @@
+import numpy as np
+from .node_registry import GrowableIndex
+
+class IncomingAdjacency():
+    """Incoming edge slots of each node. Every node has its own block of slots that works as an append buffer with doubling capacity, so the in-edges of a node are available as an array view without copying."""
+    def __init__(self,initial_block_size=4):
+        self.initial_block_size = initial_block_size
+        self.blocks = []
+        self.block_sizes = []
+
+    def add(self,trg_index,edge_slot):
+        while len(self.blocks) <= trg_index:
+            self.blocks.append(None)
+            self.block_sizes.append(0)
+        block, size = self.blocks[trg_index], self.block_sizes[trg_index]
+        if block is None:
+            block = np.zeros(self.initial_block_size, dtype=np.int64)
+        elif size == len(block):
+            block = np.concatenate((block,np.zeros(len(block), dtype=np.int64)))
+        block[size] = edge_slot
+        self.blocks[trg_index], self.block_sizes[trg_index] = block, size+1
+
+    def get_slots(self,node_index):
+        """Return the slots of the incoming edges of the node"""
+        if node_index >= len(self.blocks) or self.blocks[node_index] is None:
+            return np.zeros(0, dtype=np.int64)
+        return self.blocks[node_index][:self.block_sizes[node_index]]
+
+
+class EdgeIndex(GrowableIndex):
+    """Growable mapping from directed edges to dense edge slots. Edges are identified by the row indices of their endpoints (see NodeRegistry), packed into a single integer key. Set 'track_incoming=True' to also maintain the incoming adjacency of the nodes."""
+    def __init__(self,initial_capacity=1024,growth_factor=2.0,track_incoming=False):
+        GrowableIndex.__init__(self,initial_capacity,growth_factor)
+        self.edge_slots = {}
+        self.edge_src = np.zeros(self.capacity, dtype=np.int64)
+        self.edge_trg = np.zeros(self.capacity, dtype=np.int64)
+        self.num_of_edges = 0
+        self.incoming = IncomingAdjacency() if track_incoming else None
+
+    def __len__(self):
+        return self.num_of_edges
+
+    def _reserve(self,size):
+        if GrowableIndex._reserve(self,size):
+            self.edge_src = self.fit(self.edge_src)
+            self.edge_trg = self.fit(self.edge_trg)
+            return True
+        return False
+
+    @staticmethod
+    def get_key(src_index,trg_index):
+        return (int(src_index) << 32) | int(trg_index)
+
+    def find_slot(self,src_index,trg_index):
+        """Return the slot of the edge or None if the edge was not registered"""
+        return self.edge_slots.get(self.get_key(src_index,trg_index))
+
+    def get_slot(self,src_index,trg_index):
+        """Return the slot of the edge. Unseen edges are registered."""
+        key = self.get_key(src_index,trg_index)
+        edge_slot = self.edge_slots.get(key)
+        if edge_slot == None:
+            edge_slot = self.num_of_edges
+            self._reserve(edge_slot+1)
+            self.edge_slots[key] = edge_slot
+            self.edge_src[edge_slot], self.edge_trg[edge_slot] = src_index, trg_index
+            self.num_of_edges += 1
+            if self.incoming != None:
+                self.incoming.add(trg_index,edge_slot)
+        return edge_slot
+
+    def get_incoming_slots(self,node_index):
+        if self.incoming == None:
+            raise RuntimeError("Incoming edges are not tracked by this index!")
+        return self.incoming.get_slots(node_index)
@@ -0,0 +1,166 @@
+import ctypes
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.csgraph import shortest_path
+from multiprocessing import Pool, RawArray
+from .node_registry import hash_keys
+
+# graphs with fewer nodes are processed in the calling process
+PARALLEL_MIN_NODES = 1000
+# maximum number of entries of the distance matrix of a batch of BFS sources
+MAX_BATCH_ENTRIES = 1 << 22
+
+def graph_to_adjacency(G):
+    """Return the node list and the (src x trg) adjacency matrix of a networkx graph"""
+    nodelist = list(G)
+    node_indexes = dict((node, idx) for idx, node in enumerate(nodelist))
+    edges = np.array([(node_indexes[src], node_indexes[trg]) for src, trg in G.edges()], dtype=np.int64).reshape(-1,2)
+    adjacency = sp.csr_matrix((np.ones(len(edges)), (edges[:,0], edges[:,1])), shape=(len(nodelist),len(nodelist)))
+    return nodelist, adjacency
+
+def reciprocal_distance_sum(adjacency, sources):
+    """Sum of 1/d(source,u) over the given BFS sources for every node u (unreachable nodes and the sources themselves add 0)"""
+    dist = shortest_path(adjacency, directed=True, unweighted=True, indices=sources)
+    with np.errstate(divide="ignore"):
+        rec_dist = 1.0 / dist
+    rec_dist[dist == 0] = 0.0
+    return rec_dist.sum(axis=0)
+
+_worker_buffers = None
+
+def _init_worker(indptr, indices):
+    global _worker_buffers
+    _worker_buffers = (np.frombuffer(indptr, dtype=np.int64), np.frombuffer(indices, dtype=np.int64))
+
+def _run_worker(task):
+    num_of_nodes, num_of_edges, sources = task
+    indptr, indices = _worker_buffers[0][:num_of_nodes+1], _worker_buffers[1][:num_of_edges]
+    adjacency = sp.csr_matrix((np.ones(num_of_edges), indices, indptr), shape=(num_of_nodes,num_of_nodes))
+    return reciprocal_distance_sum(adjacency, sources)
+
+class HarmonicCentralityPool():
+    """Worker processes of 'harmonic_centrality' that are kept between calls. The CSR graph of each call is copied into shared memory buffers. The buffers grow geometrically and the workers are restarted only when a graph does not fit. The workers are not copied with the pool to other processes, call 'close' to stop them."""
+    def __init__(self, num_of_processes, initial_capacity=1024):
+        self.num_of_processes = num_of_processes
+        self.initial_capacity = initial_capacity
+        self.pool = None
+        self.indptr, self.indices = None, None
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["pool"], state["indptr"], state["indices"] = None, None, None
+        return state
+
+    def _reserve(self, num_of_nodes, num_of_edges):
+        if self.pool != None and len(self.indptr) > num_of_nodes and len(self.indices) >= num_of_edges:
+            return
+        self.close()
+        self.indptr = RawArray(ctypes.c_int64, max(2*(num_of_nodes+1), self.initial_capacity))
+        self.indices = RawArray(ctypes.c_int64, max(2*num_of_edges, self.initial_capacity))
+        self.pool = Pool(self.num_of_processes, initializer=_init_worker, initargs=(self.indptr, self.indices))
+
+    def map(self, adjacency, batches):
+        """Return the reciprocal distance sums of the batches of BFS sources in the order of the batches"""
+        num_of_nodes, num_of_edges = adjacency.shape[0], len(adjacency.indices)
+        self._reserve(num_of_nodes, num_of_edges)
+        np.frombuffer(self.indptr, dtype=np.int64)[:num_of_nodes+1] = adjacency.indptr
+        np.frombuffer(self.indices, dtype=np.int64)[:num_of_edges] = adjacency.indices
+        return self.pool.map(_run_worker, [(num_of_nodes, num_of_edges, sources) for sources in batches])
+
+    def close(self):
+        if self.pool != None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+        self.indptr, self.indices = None, None
+
+def harmonic_centrality(adjacency, num_of_processes=1, pool=None):
+    """Exact harmonic centrality of every node (the sum of 1/d(v,u) over the other nodes v, as in networkx) from the (src x trg) adjacency matrix. BFS sources are processed in batches. If 'num_of_processes' > 1 or a HarmonicCentralityPool is given then the batches are shared among worker processes that read the CSR graph from shared memory, and their partial sums are added in the same order as in a single process. Without a pool a temporary one is started for the call."""
+    adjacency = sp.csr_matrix(adjacency)
+    num_of_nodes = adjacency.shape[0]
+    if num_of_nodes == 0:
+        return np.zeros(0)
+    batch_size = max(1, min(num_of_nodes, MAX_BATCH_ENTRIES // num_of_nodes))
+    batches = [np.arange(start_idx, min(start_idx+batch_size, num_of_nodes)) for start_idx in range(0, num_of_nodes, batch_size)]
+    if (pool != None or num_of_processes > 1) and len(batches) > 1 and num_of_nodes >= PARALLEL_MIN_NODES:
+        if pool != None:
+            partial_sums = pool.map(adjacency, batches)
+        else:
+            pool = HarmonicCentralityPool(min(num_of_processes, len(batches)))
+            try:
+                partial_sums = pool.map(adjacency, batches)
+            finally:
+                pool.close()
+    else:
+        partial_sums = [reciprocal_distance_sum(adjacency, sources) for sources in batches]
+    centrality = np.zeros(num_of_nodes)
+    for partial_sum in partial_sums:
+        centrality += partial_sum
+    return centrality
+
+### HyperBall approximation ###
+
+def bit_length(values):
+    """Vectorized int.bit_length for uint64 arrays"""
+    values = values.copy()
+    length = np.zeros(len(values), dtype=np.int64)
+    for shift in [32,16,8,4,2,1]:
+        is_long = values >= np.uint64(1 << shift)
+        length[is_long] += shift
+        values[is_long] >>= np.uint64(shift)
+    return length + (values > 0)
+
+def init_registers(keys, num_of_registers, seed=0):
+    """HyperLogLog registers of the singleton sets of the keys"""
+    index_bits = int(np.log2(num_of_registers))
+    hashes = hash_keys(keys, seed)
+    register_idx = (hashes & np.uint64(num_of_registers-1)).astype(np.int64)
+    # position of the leftmost 1-bit in the remaining bits
+    ranks = (64 - index_bits) - bit_length(hashes >> np.uint64(index_bits)) + 1
+    registers = np.zeros((len(hashes),num_of_registers), dtype=np.uint8)
+    registers[np.arange(len(hashes)),register_idx] = ranks
+    return registers
+
+def estimate_cardinalities(registers):
+    """HyperLogLog estimates of the sets of the register rows (with small range correction)"""
+    num_of_registers = registers.shape[1]
+    if num_of_registers == 16:
+        alpha = 0.673
+    elif num_of_registers == 32:
+        alpha = 0.697
+    elif num_of_registers == 64:
+        alpha = 0.709
+    else:
+        alpha = 0.7213 / (1.0 + 1.079 / num_of_registers)
+    inverse_powers = np.power(2.0, -np.arange(256))
+    estimates = alpha * num_of_registers**2 / inverse_powers[registers].sum(axis=1)
+    num_of_zeros = (registers == 0).sum(axis=1)
+    small_range = (estimates <= 2.5 * num_of_registers) & (num_of_zeros > 0)
+    estimates[small_range] = num_of_registers * np.log(float(num_of_registers) / num_of_zeros[small_range])
+    return estimates
+
+def hyperball_harmonic_centrality(adjacency, num_of_registers=64, node_keys=None, seed=0):
+    """Approximate harmonic centrality with HyperBall: the HyperLogLog counter of each node estimates the set of nodes that reach it in at most t steps. The counters are propagated along the edges until they do not change, and the estimated number of nodes at distance t is added with weight 1/t. 'num_of_registers' (a power of 2, at least 16) sets the relative standard error to about 1.04/sqrt(num_of_registers). Set 'node_keys' (e.g. node identifiers) to hash the same node the same way in every graph."""
+    if num_of_registers < 16 or num_of_registers & (num_of_registers-1) != 0:
+        raise RuntimeError("'num_of_registers' must be a power of 2 and at least 16!")
+    in_adjacency = sp.csc_matrix(adjacency)
+    num_of_nodes = in_adjacency.shape[0]
+    keys = np.arange(num_of_nodes) if node_keys is None else node_keys
+    registers = init_registers(keys, num_of_registers, seed)
+    estimates = estimate_cardinalities(registers)
+    centrality = np.zeros(num_of_nodes)
+    # in-neighbours are grouped by their target in the CSC matrix
+    has_in_edges = np.flatnonzero(np.diff(in_adjacency.indptr) > 0)
+    group_starts = in_adjacency.indptr[has_in_edges]
+    for distance in range(1, num_of_nodes):
+        new_registers = registers.copy()
+        if len(has_in_edges) > 0:
+            new_registers[has_in_edges] = np.maximum(registers[has_in_edges], np.maximum.reduceat(registers[in_adjacency.indices], group_starts, axis=0))
+        changed = np.flatnonzero(np.any(new_registers != registers, axis=1))
+        if len(changed) == 0:
+            break
+        new_estimates = estimate_cardinalities(new_registers[changed])
+        centrality[changed] += (new_estimates - estimates[changed]) / distance
+        estimates[changed] = new_estimates
+        registers = new_registers
+    return centrality
@@ -3,6 +3,7 @@ import numpy as np
 import pandas as pd
 import networkx as nx
 from .base_computer import *
+from .harmonic_centrality import harmonic_centrality, graph_to_adjacency, HarmonicCentralityPool
 
 class HarmonicCentralityParams():
     def __init__(self, graph_type, distance=None):
@@ -17,35 +18,52 @@ class HarmonicCentralityParams():
 
 
 class HarmonicCentralityComputer(BaseComputer):
-    def __init__(self, param_list):
-        """Input: list of HarmonicCentralityParams objects"""
+    # static measures only read the graphs at snapshot time
+    coalescable = True
+    
+    def __init__(self, param_list, num_of_processes=1):
+        """Input: list of HarmonicCentralityParams objects. The BFS sources of unweighted parameters are shared among 'num_of_processes' worker processes. The workers are kept between the snapshots until 'close' is called."""
         self.param_list = param_list
+        self.num_of_processes = num_of_processes
+        self.pool = HarmonicCentralityPool(num_of_processes) if num_of_processes > 1 else None
         self.hc = None
 
+    def get_graph_requirements(self):
+        return set([FULL_GRAPH if param.graph_type == "total" else SNAPSHOT_EDGES for param in self.param_list])
+
     def update(self, edge, graph, snapshot_graph, time=None):
         """edge=(src,trg)"""
         # This is a static measure. It only needs to be updated at snapshot update
         pass
 
+    def update_coalesced(self, src_ids, trg_ids, multiplicities, time=None, graph=None, snapshot_graph=None):
+        pass
+
     def calculate_harmonic_centrality(self, graph, snapshot_graph):
-        hc_df = pd.DataFrame()
+        # rows of the nodes in the order of their first appearance in the parameters
+        node_indexes, hc_columns = {}, []
         for i in range(len(self.param_list)):
             param = self.param_list[i]
-            G = graph if param.graph_type == "total" else snapshot_graph
-            hc_scores = nx.harmonic_centrality(G, distance=param.distance)
-            hc_df[str(i)] = pd.Series(hc_scores)
-        hc_df.insert(0, "node_id", hc_df.index)
-        return hc_df.fillna(0.0).as_matrix()
+            G = graph if param.graph_type == "total" else nx.MultiDiGraph(snapshot_graph.edges())
+            if param.distance == None:
+                nodelist, adjacency = graph_to_adjacency(G)
+                hc_scores = dict(zip(nodelist, harmonic_centrality(adjacency, pool=self.pool)))
+            else:
+                hc_scores = nx.harmonic_centrality(G, distance=param.distance)
+            for node in hc_scores:
+                if not node in node_indexes:
+                    node_indexes[node] = len(node_indexes)
+            hc_columns.append(hc_scores)
+        hc_mx = np.zeros((len(node_indexes), 1+len(self.param_list)))
+        hc_mx[:,0] = list(node_indexes.keys())
+        for i in range(len(hc_columns)):
+            hc_mx[[node_indexes[node] for node in hc_columns[i]],i+1] = list(hc_columns[i].values())
+        return hc_mx
 
-    def save_snapshot(self, experiment_folder, snapshot_index, graph, snapshot_graph, time=None):
+    def get_snapshot(self, time=None, graph=None, snapshot_graph=None):
         self.hc = self.calculate_harmonic_centrality(graph, snapshot_graph)
-        if not os.path.exists(experiment_folder):
-            os.makedirs(experiment_folder)
-        for j in range(len(self.param_list)):
-            param = self.param_list[j]
-            output_folder = "%s/%s" % (experiment_folder, param)
-            if not os.path.exists(output_folder):
-                os.makedirs(output_folder)
-            pos_idx = self.hc[:, j+1] > 0
-            active_arr = self.hc[pos_idx][:,[0,j+1]]
-            scores2file(active_arr, "%s/hc_%i.csv" % (output_folder, snapshot_index))
+        return ScoreSnapshot("hc", self.hc[:,0], self.hc[:,1:], self.param_list, positive_only=True)
+
+    def close(self):
+        if self.pool != None:
+            self.pool.close()
@@ -0,0 +1,137 @@
+import random
+import numpy as np
+from .node_registry import GrowableIndex
+
+class MonteCarloPageRank():
+    """Incremental Monte Carlo PageRank over a sliding edge window (Bahmani et al., Fast Incremental and Personalized PageRank, 2010). 'walks_per_node' random walks start from each node of the window. A walk moves to a uniform random out-neighbour with probability 'alpha' and it ends at dangling nodes (as the reset to the uniform vector in networkx). The PageRank of a node is its share of all visits. When the window slides, only the walks that visit a node with changed out-neighbours are updated: their steps are kept or rerouted with a maximal coupling of the old and the new transition probabilities, so the walks always follow the distribution of the current window."""
+    def __init__(self,alpha,walks_per_node=10,seed=0):
+        self.alpha = alpha
+        self.walks_per_node = walks_per_node
+        self.random = random.Random(seed)
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.node_indices = np.zeros(0, dtype=np.int64)
+        self.out_neighbours = {}
+        self.walks = {}
+        self.next_walk_id = 0
+        # walk identifiers by start node and the number of visits of each walk by node
+        self.start_walks = {}
+        self.node_walks = {}
+        self.index = GrowableIndex()
+        self.visit_counts = self.index.allocate()
+        self.total_visits = 0
+        self.num_of_rerouted = 0
+
+    def __len__(self):
+        return len(self.walks)
+
+    def _add_visits(self,walk_id,nodes):
+        for node in nodes:
+            walks = self.node_walks.setdefault(node, {})
+            walks[walk_id] = walks.get(walk_id,0) + 1
+            self.visit_counts[node] += 1
+        self.total_visits += len(nodes)
+
+    def _remove_visits(self,walk_id,nodes):
+        for node in nodes:
+            walks = self.node_walks[node]
+            walks[walk_id] -= 1
+            if walks[walk_id] == 0:
+                del walks[walk_id]
+            self.visit_counts[node] -= 1
+        self.total_visits -= len(nodes)
+
+    def _continue_walk(self,walk):
+        """Extend the walk from its last node until it is reset or it reaches a dangling node"""
+        node = walk[-1]
+        while True:
+            neighbours = self.out_neighbours.get(node)
+            if not neighbours or self.random.random() >= self.alpha:
+                return walk
+            node = neighbours[int(self.random.random() * len(neighbours))]
+            walk.append(node)
+
+    def _set_suffix(self,walk_id,pos,suffix):
+        walk = self.walks[walk_id]
+        self._remove_visits(walk_id, walk[pos:])
+        walk[pos:] = suffix
+        self._add_visits(walk_id, suffix)
+        self.num_of_rerouted += 1
+
+    def _sample_residual(self,old_set,new_neighbours):
+        """Sample the next node from the part of the new transition probabilities that is not covered by the old ones"""
+        only_new = [node for node in new_neighbours if not node in old_set]
+        if len(new_neighbours) >= len(old_set):
+            return only_new[int(self.random.random() * len(only_new))]
+        common = [node for node in new_neighbours if node in old_set]
+        new_weight = len(only_new) / float(len(new_neighbours))
+        common_weight = len(common) * (1.0 / len(new_neighbours) - 1.0 / len(old_set))
+        if self.random.random() * (new_weight + common_weight) < new_weight:
+            return only_new[int(self.random.random() * len(only_new))]
+        return common[int(self.random.random() * len(common))]
+
+    def _reroute(self,walk_id,old_sets,new_sets):
+        walk = self.walks[walk_id]
+        for pos in range(len(walk)):
+            node = walk[pos]
+            if not node in old_sets:
+                continue
+            old_set, new_neighbours = old_sets[node], self.out_neighbours.get(node, [])
+            if pos == len(walk)-1:
+                # the walk was reset here (unchanged probability) or the node was dangling
+                if len(old_set) == 0 and len(new_neighbours) > 0:
+                    self._set_suffix(walk_id, pos+1, self._continue_walk([node])[1:])
+                return
+            if len(new_neighbours) == 0:
+                self._set_suffix(walk_id, pos+1, [])
+                return
+            if walk[pos+1] in new_sets[node] and (len(new_neighbours) <= len(old_set) or self.random.random() < len(old_set) / float(len(new_neighbours))):
+                continue
+            self._set_suffix(walk_id, pos+1, self._continue_walk([self._sample_residual(old_set, new_neighbours)]))
+            return
+
+    def update(self,view):
+        """Update the walks to the edges of the WindowGraph and return the PageRank of its nodes"""
+        node_indices = view.node_indices
+        if len(node_indices) > 0 and self.index._reserve(int(node_indices[-1])+1):
+            self.visit_counts = self.index.fit(self.visit_counts)
+        keys = (node_indices[view.src_indices] << 32) | node_indices[view.indices]
+        added = np.setdiff1d(keys, self.keys, assume_unique=True)
+        removed = np.setdiff1d(self.keys, keys, assume_unique=True)
+        self.keys = keys
+        # out-neighbours of the changed nodes before and after the update
+        old_sets = {}
+        for key in np.concatenate((removed, added)).tolist():
+            src = key >> 32
+            if not src in old_sets:
+                old_sets[src] = set(self.out_neighbours.get(src, []))
+        for key in removed.tolist():
+            neighbours = self.out_neighbours[key >> 32]
+            neighbours.remove(key & 0xFFFFFFFF)
+            if len(neighbours) == 0:
+                del self.out_neighbours[key >> 32]
+        for key in added.tolist():
+            self.out_neighbours.setdefault(key >> 32, []).append(key & 0xFFFFFFFF)
+        new_sets = dict((node, set(self.out_neighbours.get(node, []))) for node in old_sets)
+        self.num_of_rerouted = 0
+        affected_walks = set()
+        for node in old_sets:
+            affected_walks.update(self.node_walks.get(node, {}).keys())
+        for walk_id in sorted(affected_walks):
+            self._reroute(walk_id, old_sets, new_sets)
+        # nodes without edges leave the window with their walks, new nodes start their own walks
+        for node in np.setdiff1d(self.node_indices, node_indices, assume_unique=True).tolist():
+            for walk_id in self.start_walks.pop(node):
+                self._remove_visits(walk_id, self.walks.pop(walk_id))
+            self.node_walks.pop(node, None)
+        for node in np.setdiff1d(node_indices, self.node_indices, assume_unique=True).tolist():
+            self.start_walks[node] = []
+            for i in range(self.walks_per_node):
+                walk_id = self.next_walk_id
+                self.next_walk_id += 1
+                self.walks[walk_id] = self._continue_walk([node])
+                self.start_walks[node].append(walk_id)
+                self._add_visits(walk_id, self.walks[walk_id])
+        self.node_indices = node_indices
+        if self.total_visits == 0:
+            return np.zeros(len(node_indices))
+        return self.visit_counts[node_indices] / float(self.total_visits)
@@ -0,0 +1,108 @@
+import numpy as np
+
+def hash_keys(keys, seed=0):
+    """64-bit SplitMix64 hash of integer keys"""
+    z = np.asarray(keys).astype(np.uint64) + np.uint64(((seed+1) * 0x9E3779B97F4A7C15) % (1 << 64))
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return z ^ (z >> np.uint64(31))
+
+class GrowableIndex():
+    """Base class for dense indices with geometrically growing capacity. The arrays of the owners are extended to the current capacity with 'fit'."""
+    def __init__(self,initial_capacity=1024,growth_factor=2.0):
+        if growth_factor <= 1.0:
+            raise RuntimeError("'growth_factor' must be greater than 1!")
+        self.growth_factor = growth_factor
+        self._capacity = max(int(initial_capacity),1)
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    def _reserve(self,size):
+        """Grow the capacity to at least 'size'. Returns True if the capacity has changed."""
+        if size <= self._capacity:
+            return False
+        while self._capacity < size:
+            self._capacity = int(np.ceil(self._capacity * self.growth_factor))
+        return True
+
+    def allocate(self,num_of_columns=None,fill_value=0.0,dtype=np.float64):
+        """Allocate an array with the current capacity of the index"""
+        shape = (self.capacity,) if num_of_columns == None else (self.capacity,num_of_columns)
+        return np.full(shape, fill_value, dtype=dtype)
+
+    def fit(self,arr,capacity=None,fill_value=0.0):
+        """Extend the rows of an array to the capacity of the index. The original array is returned if it is large enough."""
+        capacity = self.capacity if capacity == None else capacity
+        if len(arr) >= capacity:
+            return arr
+        extended = np.full((capacity,)+arr.shape[1:], fill_value, dtype=arr.dtype)
+        extended[:len(arr)] = arr
+        return extended
+
+class NodeRegistry(GrowableIndex):
+    """Growable mapping from node identifiers to dense row indices. Node arrays of the computers are resized geometrically when new nodes arrive, so the node universe does not have to be known in advance. One registry can be shared by several computers."""
+    def __init__(self,nodes=None,initial_capacity=1024,growth_factor=2.0):
+        GrowableIndex.__init__(self,initial_capacity,growth_factor)
+        self.node_indexes = {}
+        self.node_ids = np.zeros(self.capacity, dtype=np.int64)
+        self.num_of_nodes = 0
+        if nodes is not None:
+            self.add_nodes(nodes)
+
+    def __len__(self):
+        return self.num_of_nodes
+
+    def __contains__(self,node_id):
+        return node_id in self.node_indexes
+
+    def _reserve(self,size):
+        if GrowableIndex._reserve(self,size):
+            self.node_ids = self.fit(self.node_ids)
+            return True
+        return False
+
+    def get_index(self,node_id):
+        """Return the row index of the node. Unseen nodes are registered."""
+        node_index = self.node_indexes.get(node_id)
+        if node_index == None:
+            node_index = self.num_of_nodes
+            self._reserve(node_index+1)
+            self.node_indexes[node_id] = node_index
+            self.node_ids[node_index] = node_id
+            self.num_of_nodes += 1
+        return node_index
+
+    def get_indices(self,node_ids):
+        """Vectorized version of 'get_index'"""
+        return np.array([self.get_index(node_id) for node_id in node_ids], dtype=np.int64)
+
+    def add_nodes(self,nodes):
+        self._reserve(self.num_of_nodes + len(nodes))
+        for node_id in nodes:
+            self.get_index(node_id)
+
+    def get_node_ids(self,node_indices=None):
+        """Return the identifiers of the given rows (or of every registered node)"""
+        if node_indices is None:
+            return self.node_ids[:self.num_of_nodes]
+        return self.node_ids[node_indices]
+
+class NodeActivity():
+    """Last activation time of the nodes of a registry, stored in node-indexed arrays together with an 'active' bitmap"""
+    def __init__(self,registry):
+        self.registry = registry
+        self.last_activation = registry.allocate()
+        self.is_active = registry.allocate(fill_value=False, dtype=bool)
+
+    def fit(self):
+        self.last_activation = self.registry.fit(self.last_activation)
+        self.is_active = self.registry.fit(self.is_active, fill_value=False)
+
+    def activate(self,node_index,time):
+        self.last_activation[node_index] = time
+        self.is_active[node_index] = True
+
+    def get_active_indices(self):
+        return np.flatnonzero(self.is_active[:len(self.registry)])
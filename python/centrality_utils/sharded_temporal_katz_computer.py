@@ -0,0 +1,213 @@
+import multiprocessing
+from collections import deque
+from queue import Empty
+import numpy as np
+from .base_computer import *
+from .weight_funtions import *
+from .node_registry import NodeRegistry, hash_keys
+from .temporal_katz_computer import TemporalKatzComputer, LandmarkScaler
+
+class TemporalKatzShard():
+    """Worker side of ShardedTemporalKatzComputer: a TemporalKatzComputer of the nodes of one shard. The source ranks of the edges between shards are sent to the inbox of the target's shard. Outgoing ranks are buffered and flushed before the shard blocks, so the shards never wait for each other in a cycle."""
+    def __init__(self,shard_id,computer,inboxes,message_size=1024):
+        self.shard_id = shard_id
+        self.computer = computer
+        self.inboxes = inboxes
+        self.message_size = message_size
+        self.outgoing = [[] for i in range(len(inboxes))]
+        self.incoming = [deque([]) for i in range(len(inboxes))]
+
+    def send(self,shard_id,src_rank):
+        self.outgoing[shard_id].append(src_rank)
+        if len(self.outgoing[shard_id]) >= self.message_size:
+            self.flush(shard_id)
+
+    def flush(self,shard_id=None):
+        for i in (range(len(self.outgoing)) if shard_id == None else [shard_id]):
+            if len(self.outgoing[i]) > 0:
+                self.inboxes[i].put((self.shard_id, np.array(self.outgoing[i])))
+                self.outgoing[i] = []
+
+    def receive(self,shard_id):
+        """Return the next source rank sent by the given shard"""
+        while len(self.incoming[shard_id]) == 0:
+            self.flush()
+            source_id, src_ranks = self.inboxes[self.shard_id].get()
+            self.incoming[source_id].extend(src_ranks)
+        return self.incoming[shard_id].popleft()
+
+    def process_edges(self,times,src_ids,trg_ids,src_shards,trg_shards,markers):
+        """Process the edges of the shard in their original order. 'markers' are (position,time) pairs of landmark renormalizations."""
+        marker_idx = 0
+        for i, (time, src, trg, src_shard, trg_shard) in enumerate(zip(times.tolist(), src_ids.tolist(), trg_ids.tolist(), src_shards.tolist(), trg_shards.tolist())):
+            while marker_idx < len(markers) and markers[marker_idx][0] <= i:
+                self.computer.renormalize(markers[marker_idx][1])
+                marker_idx += 1
+            if src_shard != self.shard_id:
+                self.computer.update_target(trg, self.receive(src_shard), time)
+            elif trg_shard != self.shard_id:
+                self.send(trg_shard, self.computer.update_source(src, time))
+            else:
+                self.computer.update((src,trg), time)
+        for position, time in markers[marker_idx:]:
+            self.computer.renormalize(time)
+        self.flush()
+
+def _run_shard(shard_id,computer,commands,inboxes,results,message_size):
+    """Worker loop of a shard: process edge batches and answer snapshot requests until None is received, then send back the computer"""
+    shard = TemporalKatzShard(shard_id, computer, inboxes, message_size=message_size)
+    try:
+        while True:
+            command = commands.get()
+            if command == None:
+                results.put((shard_id, shard.computer))
+                return
+            if command[0] == "edges":
+                shard.process_edges(*command[1:])
+            else:
+                results.put((shard_id, shard.computer.get_all_updated_node_ranks(command[1])))
+    except Exception as e:
+        results.put((shard_id, e))
+
+class ShardedTemporalKatzComputer(BaseComputer):
+    """Temporal Katz centrality with the nodes hash-partitioned into 'num_of_shards' worker processes. Each shard updates the ranks of its own nodes with a TemporalKatzComputer. The edges are buffered and sent to the shards of their endpoints in batches of 'batch_size' edges. If the source and the target of an edge belong to different shards, the source rank is sent to the target's shard as a message. Every shard processes its edges in the original order, so the scores are the same as with TemporalKatzComputer (with sequential updates). Landmark renormalizations are decided here and broadcast, so every shard uses the same landmark. The snapshots are gathered from the shards in the node order of TemporalKatzComputer. The shard processes are started on the first update; 'close' stops them and copies their state back."""
+    def __init__(self,nodes,param_list,num_of_shards=2,use_landmark=False,registry=None,batch_size=100000,message_size=1024,seed=0):
+        if num_of_shards < 1:
+            raise RuntimeError("'num_of_shards' must be positive!")
+        self.param_list = param_list
+        self.num_of_shards = num_of_shards
+        self.batch_size = batch_size
+        self.message_size = message_size
+        self.seed = seed
+        # the registry only keeps the order of the node arrivals for the export
+        self.registry = NodeRegistry() if registry == None else registry
+        if nodes is not None:
+            self.registry.add_nodes(nodes)
+        self.landmark = LandmarkScaler(WeightBank(param_list)) if use_landmark else None
+        self.shard_computers = [TemporalKatzComputer(None,param_list,use_landmark=use_landmark) for i in range(num_of_shards)]
+        self.buffer = []
+        self.num_of_buffered = 0
+        self.processes = []
+        self.commands, self.inboxes, self.results = None, None, None
+
+    def __getstate__(self):
+        """The shard processes are stopped and their state is copied before the computer is copied to another process"""
+        self.close()
+        state = BaseComputer.__getstate__(self)
+        state["commands"], state["inboxes"], state["results"] = None, None, None
+        return state
+
+    def get_graph_requirements(self):
+        return set()
+
+    def get_shards(self,node_ids):
+        return (hash_keys(node_ids, self.seed) % np.uint64(self.num_of_shards)).astype(np.int64)
+
+    def start(self):
+        self.commands = [multiprocessing.Queue() for i in range(self.num_of_shards)]
+        self.inboxes = [multiprocessing.Queue() for i in range(self.num_of_shards)]
+        self.results = multiprocessing.Queue()
+        for i in range(self.num_of_shards):
+            process = multiprocessing.Process(target=_run_shard, args=(i, self.shard_computers[i], self.commands[i], self.inboxes, self.results, self.message_size))
+            process.daemon = True
+            process.start()
+            self.processes.append(process)
+
+    def update(self,edge,time,graph=None,snapshot_graph=None):
+        self.update_many(np.array([edge[0]]), np.array([edge[1]]), time=time)
+
+    def update_many(self,src_ids,trg_ids,time=None,graph=None,snapshot_graph=None):
+        self.buffer.append((time, np.asarray(src_ids, dtype=np.int64), np.asarray(trg_ids, dtype=np.int64)))
+        self.num_of_buffered += len(src_ids)
+        if self.num_of_buffered >= self.batch_size:
+            self.dispatch()
+
+    def get_markers(self,times):
+        """Positions and times of the landmark renormalizations of TemporalKatzComputer (the landmark is also set at the first edge)"""
+        markers = []
+        if self.landmark != None:
+            for i in np.flatnonzero(np.concatenate(([True], times[1:] != times[:-1]))).tolist():
+                time = times[i]
+                if self.landmark.landmark_time == None or self.landmark.needs_renormalization(time):
+                    self.landmark.set_landmark(time)
+                    markers.append((i, time))
+        return markers
+
+    def dispatch(self):
+        """Send the buffered edges to the shards of their endpoints"""
+        if self.num_of_buffered == 0:
+            return
+        if len(self.processes) == 0:
+            self.start()
+        times = np.concatenate([np.repeat(time, len(src_ids)) for time, src_ids, trg_ids in self.buffer])
+        src_ids = np.concatenate([batch[1] for batch in self.buffer])
+        trg_ids = np.concatenate([batch[2] for batch in self.buffer])
+        self.buffer, self.num_of_buffered = [], 0
+        # nodes are registered in the order of their first appearance
+        endpoints = np.column_stack((src_ids,trg_ids)).ravel()
+        unique_nodes, first_idx = np.unique(endpoints, return_index=True)
+        self.registry.add_nodes(unique_nodes[np.argsort(first_idx)].tolist())
+        src_shards, trg_shards = self.get_shards(src_ids), self.get_shards(trg_ids)
+        markers = self.get_markers(times)
+        marker_positions = np.array([position for position, time in markers], dtype=np.int64)
+        for i in range(self.num_of_shards):
+            edge_indices = np.flatnonzero((src_shards == i) | (trg_shards == i))
+            # renormalizations are placed before the next edge of the shard
+            shard_markers = list(zip(np.searchsorted(edge_indices, marker_positions).tolist(), [time for position, time in markers]))
+            self.commands[i].put(("edges", times[edge_indices], src_ids[edge_indices], trg_ids[edge_indices], src_shards[edge_indices], trg_shards[edge_indices], shard_markers))
+
+    def gather(self):
+        """Collect one result from every shard"""
+        results = {}
+        while len(results) < len(self.processes):
+            try:
+                shard_id, result = self.results.get(timeout=1.0)
+            except Empty:
+                if any(not process.is_alive() for process in self.processes):
+                    self.terminate()
+                    raise RuntimeError("A shard process stopped unexpectedly!")
+                continue
+            if isinstance(result, Exception):
+                self.terminate()
+                raise result
+            results[shard_id] = result
+        return [results[i] for i in range(len(self.processes))]
+
+    def get_all_updated_node_ranks(self,time):
+        self.dispatch()
+        if len(self.processes) == 0:
+            shard_ranks = [comp.get_all_updated_node_ranks(time) for comp in self.shard_computers]
+        else:
+            for commands in self.commands:
+                commands.put(("snapshot", time))
+            shard_ranks = self.gather()
+        all_nodes_updated = np.concatenate(shard_ranks)
+        # order of the nodes in the registry
+        node_ids = self.registry.get_node_ids()
+        id_order = np.argsort(node_ids)
+        node_indices = id_order[np.searchsorted(node_ids, all_nodes_updated[:,0].astype(np.int64), sorter=id_order)]
+        return all_nodes_updated[np.argsort(node_indices)]
+
+    def get_snapshot(self,time=None,graph=None,snapshot_graph=None):
+        all_nodes_updated = self.get_all_updated_node_ranks(time)
+        return ScoreSnapshot("tk",all_nodes_updated[:,0],all_nodes_updated[:,1:],self.param_list)
+
+    def close(self):
+        """Process the buffered edges, stop the shard processes and copy their computers back"""
+        if len(self.processes) == 0:
+            return
+        self.dispatch()
+        for commands in self.commands:
+            commands.put(None)
+        self.shard_computers = self.gather()
+        for process in self.processes:
+            process.join()
+        self.processes = []
+
+    def terminate(self):
+        """Stop the shard processes without waiting for them (e.g. after an error)"""
+        for process in self.processes:
+            if process.is_alive():
+                process.terminate()
+            process.join()
+        self.processes = []
@@ -0,0 +1,77 @@
+import os, json
+import numpy as np
+
+SNAPSHOT_MAGIC = b"OCSCORE1"
+SNAPSHOT_VERSION = 1
+SNAPSHOT_ALIGNMENT = 64
+ID_DTYPE = np.dtype("<i8")
+SCORE_DTYPE = np.dtype("<f8")
+
+def get_snapshot_path(folder,file_prefix,snapshot_index):
+    return "%s/%s_%i.bin" % (folder,file_prefix,snapshot_index)
+
+def write_score_snapshot(file_path,node_ids,scores,columns,positive_only=False):
+    """Write the node identifiers and the (nodes x columns) score matrix into one binary file. The matrix is stored in column-major order, so each column is a contiguous block that can be memory-mapped or read on its own."""
+    node_ids = np.asarray(node_ids).astype(ID_DTYPE)
+    scores = np.asarray(scores, dtype=SCORE_DTYPE).reshape(len(node_ids),len(columns))
+    header = {"version":SNAPSHOT_VERSION, "num_of_nodes":len(node_ids), "columns":[str(col) for col in columns], "positive_only":bool(positive_only)}
+    header_bytes = json.dumps(header).encode("utf-8")
+    header_size = len(SNAPSHOT_MAGIC) + 8 + len(header_bytes)
+    padding = (SNAPSHOT_ALIGNMENT - header_size % SNAPSHOT_ALIGNMENT) % SNAPSHOT_ALIGNMENT
+    # readers never see partially written files
+    tmp_path = file_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(SNAPSHOT_MAGIC)
+        f.write(np.array([len(header_bytes)], dtype="<u8").tobytes())
+        f.write(header_bytes)
+        f.write(b"\0" * padding)
+        f.write(node_ids.tobytes())
+        f.write(scores.tobytes(order="F"))
+    os.replace(tmp_path, file_path)
+
+def read_snapshot_header(file_path):
+    """Return the header of a binary snapshot. 'data_offset' is the position of the node identifiers."""
+    with open(file_path, "rb") as f:
+        if f.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+            raise RuntimeError("Invalid score snapshot file: %s" % file_path)
+        header_len = int(np.frombuffer(f.read(8), dtype="<u8")[0])
+        header = json.loads(f.read(header_len).decode("utf-8"))
+    if header["version"] != SNAPSHOT_VERSION:
+        raise RuntimeError("Unsupported score snapshot version: %s" % header["version"])
+    header_size = len(SNAPSHOT_MAGIC) + 8 + header_len
+    header["data_offset"] = header_size + (SNAPSHOT_ALIGNMENT - header_size % SNAPSHOT_ALIGNMENT) % SNAPSHOT_ALIGNMENT
+    return header
+
+def load_score_snapshot(file_path,mmap=True):
+    """Return the node identifiers, the (nodes x columns) score matrix and the header of a binary snapshot. The arrays are memory-mapped if 'mmap' is True."""
+    header = read_snapshot_header(file_path)
+    num_of_nodes, num_of_columns = header["num_of_nodes"], len(header["columns"])
+    score_offset = header["data_offset"] + num_of_nodes * ID_DTYPE.itemsize
+    if num_of_nodes == 0:
+        return np.zeros(0, dtype=ID_DTYPE), np.zeros((0,num_of_columns), dtype=SCORE_DTYPE), header
+    if mmap:
+        node_ids = np.memmap(file_path, dtype=ID_DTYPE, mode="r", offset=header["data_offset"], shape=(num_of_nodes,))
+        scores = np.memmap(file_path, dtype=SCORE_DTYPE, mode="r", offset=score_offset, shape=(num_of_nodes,num_of_columns), order="F")
+    else:
+        with open(file_path, "rb") as f:
+            f.seek(header["data_offset"])
+            node_ids = np.fromfile(f, dtype=ID_DTYPE, count=num_of_nodes)
+            scores = np.fromfile(f, dtype=SCORE_DTYPE, count=num_of_nodes*num_of_columns).reshape((num_of_nodes,num_of_columns), order="F")
+    return node_ids, scores, header
+
+def load_score_column(file_path,column):
+    """Read the node identifiers and one score column of a binary snapshot without reading the other columns. Nodes with non-positive scores are dropped for 'positive_only' snapshots (as in the legacy .csv output)."""
+    header = read_snapshot_header(file_path)
+    if not column in header["columns"]:
+        raise RuntimeError("Column '%s' is missing from %s" % (column,file_path))
+    num_of_nodes = header["num_of_nodes"]
+    col_idx = header["columns"].index(column)
+    with open(file_path, "rb") as f:
+        f.seek(header["data_offset"])
+        node_ids = np.fromfile(f, dtype=ID_DTYPE, count=num_of_nodes)
+        f.seek(header["data_offset"] + num_of_nodes * (ID_DTYPE.itemsize + col_idx * SCORE_DTYPE.itemsize))
+        values = np.fromfile(f, dtype=SCORE_DTYPE, count=num_of_nodes)
+    if header["positive_only"]:
+        pos_idx = values > 0
+        node_ids, values = node_ids[pos_idx], values[pos_idx]
+    return node_ids, values
@@ -1,54 +1,69 @@
 import os
 import numpy as np
-import pandas as pd
-import networkx as nx
-from collections import deque
 from .base_computer import *
+from .harmonic_centrality import harmonic_centrality, hyperball_harmonic_centrality, HarmonicCentralityPool
 
 class StaticHarmonicCentralityParams():
-    def __init__(self,lookback_cnt=0):
+    def __init__(self,lookback_cnt=0,num_of_registers=None):
+        """The scores are exact if 'num_of_registers'=None, otherwise they are approximated by HyperBall with HyperLogLog counters of 'num_of_registers' registers (a power of 2, at least 16)."""
         self.lookback_cnt = lookback_cnt
+        if num_of_registers != None and (num_of_registers < 16 or num_of_registers & (num_of_registers-1) != 0):
+            raise RuntimeError("'num_of_registers' must be a power of 2 and at least 16!")
+        self.num_of_registers = num_of_registers
         if lookback_cnt > 0:
             self.graph_type = "snapshot_%i" % lookback_cnt
         else:
             self.graph_type = "total"
         
     def __str__(self):
-        return "hc_%s" % (self.graph_type)
+        if self.num_of_registers == None:
+            return "hc_%s" % (self.graph_type)
+        else:
+            return "hc_%s_hll%i" % (self.graph_type,self.num_of_registers)
 
 class StaticHarmonicCentralityComputer(BaseComputer):
-    def __init__(self,param_list):
-        """Input: list of StaticHarmonicCentralityParams objects"""
+    # static measures only read the graphs at snapshot time
+    coalescable = True
+    pipelinable = True
+    
+    def __init__(self,param_list,num_of_processes=1):
+        """Input: list of StaticHarmonicCentralityParams objects. The BFS sources are shared among 'num_of_processes' worker processes. The workers are kept between the snapshots until 'close' is called."""
         self.param_list = param_list
-        self.graph_snapshots = [deque([]) for i in range(len(self.param_list))]
+        self.num_of_processes = num_of_processes
+        self.pool = HarmonicCentralityPool(num_of_processes) if num_of_processes > 1 else None
         self.stat_hc = None
         
+    def get_graph_requirements(self):
+        """Every parameter reads a view of the shared edge window"""
+        return set([EDGE_WINDOW])
+    
+    def get_lookback_counts(self):
+        return [param.lookback_cnt for param in self.param_list]
+        
     def update(self,edge,graph,snapshot_graph,time=None):
         """edge=(src,trg)"""
         # This is a static measure. It only needs to be updated at snapshot update
         pass
 
-    def calculate_harmonic_centralities(self,graph,snapshot_graph,epsilon=0.001):
-        hc_df = pd.DataFrame()
+    def update_coalesced(self,src_ids,trg_ids,multiplicities,time=None,graph=None,snapshot_graph=None):
+        pass
+
+    def calculate_harmonic_centralities(self,snapshot_graph,epsilon=0.001):
+        views, rows, hc_mx = init_window_scores(snapshot_graph, self.param_list)
         for i in range(len(self.param_list)):
-            param = self.param_list[i]
-            G = nx.DiGraph(graph) if param.lookback_cnt == 0 else get_graph_from_snapshots(self, snapshot_graph, param, i)
-            hc_values = nx.harmonic_centrality(G)
+            param, view = self.param_list[i], views[i]
+            if param.num_of_registers == None:
+                hc_values = harmonic_centrality(view.to_scipy(), pool=self.pool)
+            else:
+                hc_values = hyperball_harmonic_centrality(view.to_scipy(), num_of_registers=param.num_of_registers, node_keys=view.node_ids)
             # we want to included zero hc value nodes in output files as well, that is why we add epsilon!
-            hc_with_epsilon = pd.Series(hc_values) + epsilon
-            new_col_df = pd.DataFrame({str(i):hc_with_epsilon})
-            hc_df = hc_df.join(new_col_df, how='outer')
-        hc_df.insert(0,"node_id",hc_df.index)
-        return hc_df.fillna(0.0).as_matrix()
+            hc_mx[rows[i],i+1] = hc_values + epsilon
+        return hc_mx
         
-    def save_snapshot(self,experiment_folder,snapshot_index,graph,snapshot_graph,time=None):
-        self.stat_hc = self.calculate_harmonic_centralities(graph,snapshot_graph)
-        if not os.path.exists(experiment_folder):
-            os.makedirs(experiment_folder)
-        for j, param in enumerate(self.param_list):
-            output_folder = "%s/%s" % (experiment_folder,param)
-            if not os.path.exists(output_folder):
-                os.makedirs(output_folder)
-            pos_idx = self.stat_hc[:,j+1] > 0 
-            active_arr = self.stat_hc[pos_idx][:,[0,j+1]]
-            scores2file(active_arr,"%s/hc_%i.csv" % (output_folder,snapshot_index))
\ No newline at end of file
+    def get_snapshot(self,time=None,graph=None,snapshot_graph=None):
+        self.stat_hc = self.calculate_harmonic_centralities(snapshot_graph)
+        return ScoreSnapshot("hc",self.stat_hc[:,0],self.stat_hc[:,1:],self.param_list,positive_only=True)
+    
+    def close(self):
+        if self.pool != None:
+            self.pool.close()
@@ -1,8 +1,5 @@
 import os
 import numpy as np
-import pandas as pd
-import networkx as nx
-from collections import deque
 from .base_computer import *
 
 class StaticIndegreeParams():
@@ -18,38 +15,39 @@ class StaticIndegreeParams():
 
     
 class StaticIndegreeComputer(BaseComputer):
+    # static measures only read the graphs at snapshot time
+    coalescable = True
+    pipelinable = True
+    
     def __init__(self,param_list):
         """Input: list of StaticIndegreeParams objects"""
         self.param_list = param_list
-        self.graph_snapshots = [deque([]) for i in range(len(self.param_list))]
         self.stat_indeg = None
         
+    def get_graph_requirements(self):
+        """Every parameter reads a view of the shared edge window"""
+        return set([EDGE_WINDOW])
+    
+    def get_lookback_counts(self):
+        return [param.lookback_cnt for param in self.param_list]
+        
     def update(self,edge,graph,snapshot_graph,time=None):
         """edge=(src,trg)"""
         # This is a static measure. It only needs to be updated at snapshot update
         pass
+
+    def update_coalesced(self,src_ids,trg_ids,multiplicities,time=None,graph=None,snapshot_graph=None):
+        pass
     
-    def calculate_indegrees(self,graph,snapshot_graph,epsilon=0.001):
-        indeg_df = pd.DataFrame()
+    def calculate_indegrees(self,snapshot_graph,epsilon=0.001):
+        """Number of distinct in-neighbours in the window of each parameter"""
+        views, rows, indeg_mx = init_window_scores(snapshot_graph, self.param_list)
         for i in range(len(self.param_list)):
-            param = self.param_list[i]
-            G = nx.DiGraph(graph) if param.lookback_cnt == 0 else get_graph_from_snapshots(self, snapshot_graph, param, i)
-            in_degs = dict(G.in_degree())
+            view = views[i]
             # we want to included zero indegree nodes in output files as well, that is why we add epsilon!
-            indeg_with_epsilon = pd.Series(in_degs) + epsilon
-            new_col_df = pd.DataFrame({str(i):indeg_with_epsilon})
-            indeg_df = indeg_df.join(new_col_df, how='outer')
-        indeg_df.insert(0,"node_id",indeg_df.index)
-        return indeg_df.fillna(0.0).as_matrix()
+            indeg_mx[rows[i],i+1] = np.bincount(view.indices, minlength=len(view)) + epsilon
+        return indeg_mx
         
-    def save_snapshot(self,experiment_folder,snapshot_index,graph,snapshot_graph,time=None):
-        self.stat_indeg = self.calculate_indegrees(graph,snapshot_graph)
-        if not os.path.exists(experiment_folder):
-            os.makedirs(experiment_folder)
-        for j, param in enumerate(self.param_list):
-            output_folder = "%s/%s" % (experiment_folder,param)
-            if not os.path.exists(output_folder):
-                os.makedirs(output_folder)
-            pos_idx = self.stat_indeg[:,j+1] > 0 
-            active_arr = self.stat_indeg[pos_idx][:,[0,j+1]]
-            scores2file(active_arr,"%s/indeg_%i.csv" % (output_folder,snapshot_index))
+    def get_snapshot(self,time=None,graph=None,snapshot_graph=None):
+        self.stat_indeg = self.calculate_indegrees(snapshot_graph)
+        return ScoreSnapshot("indeg",self.stat_indeg[:,0],self.stat_indeg[:,1:],self.param_list,positive_only=True)
@@ -1,8 +1,5 @@
 import os
 import numpy as np
-import pandas as pd
-import networkx as nx
-from collections import deque
 from .base_computer import *
 
 class StaticNegativeBetaMeasureParams():
@@ -17,46 +14,41 @@ class StaticNegativeBetaMeasureParams():
         return "nbm_%s" % (self.graph_type)
 
 class StaticNegativeBetaMeasureComputer(BaseComputer):
+    # static measures only read the graphs at snapshot time
+    coalescable = True
+    pipelinable = True
+    
     def __init__(self,param_list):
         """Input: list of StaticNegativeBetaMeasureParams objects"""
         self.param_list = param_list
-        self.graph_snapshots = [deque([]) for i in range(len(self.param_list))]
         self.stat_nbmes = None
 
+    def get_graph_requirements(self):
+        """Every parameter reads a view of the shared edge window"""
+        return set([EDGE_WINDOW])
+    
+    def get_lookback_counts(self):
+        return [param.lookback_cnt for param in self.param_list]
+        
     def update(self,edge,graph,snapshot_graph,time=None):
         """edge=(src,trg)"""
         # This is a static measure. It only needs to be updated at snapshot update
         pass
 
-    def calculate_neg_beta_measures(self,graph,snapshot_graph,epsilon=0.001):
-        nbmes_df = pd.DataFrame()
+    def update_coalesced(self,src_ids,trg_ids,multiplicities,time=None,graph=None,snapshot_graph=None):
+        pass
+
+    def calculate_neg_beta_measures(self,snapshot_graph,epsilon=0.001):
+        """Sum of the reciprocal outdegrees of the in-neighbours in the window of each parameter"""
+        views, rows, nbmes_mx = init_window_scores(snapshot_graph, self.param_list)
         for i in range(len(self.param_list)):
-            param = self.param_list[i]
-            G = nx.DiGraph(graph) if param.lookback_cnt == 0 else get_graph_from_snapshots(self, snapshot_graph, param, i)
-            out_deg = dict(G.out_degree())
-            # calculate weights for in edges
-            rec_out_deg = dict([(n,1.0/out_deg[n] if out_deg[n] > 0 else 1.0) for n in out_deg])
-            edges_with_weights = [(link[0],link[1],rec_out_deg[link[0]]) for link in G.edges()]
-            # re-initialize the snapshot graph with 'in_weights'
-            G.clear()
-            G.add_weighted_edges_from(edges_with_weights,weight="in_weight")
-            nbmes = dict(G.in_degree(weight="in_weight")) # due to the 'in_weight' values on the edges the result is the negative beta measure
+            view = views[i]
+            # each edge is weighted by the reciprocal outdegree of its source
+            rec_out_deg = 1.0 / np.maximum(np.diff(view.indptr), 1)
             # we want to included zero neg. beta measure nodes in output files as well, that is why we add epsilon!
-            nbmes_with_epsilon = pd.Series(nbmes) + epsilon
-            new_col_df = pd.DataFrame({str(i):nbmes_with_epsilon})
-            nbmes_df = nbmes_df.join(new_col_df, how='outer')
-        nbmes_df.insert(0,"node_id",nbmes_df.index)
-        return nbmes_df.fillna(0.0).as_matrix()
-
+            nbmes_mx[rows[i],i+1] = np.bincount(view.indices, weights=rec_out_deg[view.src_indices], minlength=len(view)) + epsilon
+        return nbmes_mx
 
-    def save_snapshot(self,experiment_folder,snapshot_index,graph,snapshot_graph,time=None):
-        self.stat_nbmes = self.calculate_neg_beta_measures(graph,snapshot_graph)
-        if not os.path.exists(experiment_folder):
-            os.makedirs(experiment_folder)
-        for j, param in enumerate(self.param_list):
-            output_folder = "%s/%s" % (experiment_folder,param)
-            if not os.path.exists(output_folder):
-                os.makedirs(output_folder)
-            pos_idx = self.stat_nbmes[:,j+1] > 0 
-            active_arr = self.stat_nbmes[pos_idx][:,[0,j+1]]
-            scores2file(active_arr,"%s/nbm_%i.csv" % (output_folder,snapshot_index))
+    def get_snapshot(self,time=None,graph=None,snapshot_graph=None):
+        self.stat_nbmes = self.calculate_neg_beta_measures(snapshot_graph)
+        return ScoreSnapshot("nbm",self.stat_nbmes[:,0],self.stat_nbmes[:,1:],self.param_list,positive_only=True)
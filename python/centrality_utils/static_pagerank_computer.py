@@ -1,13 +1,17 @@
 import os
-import numpy as np
-import pandas as pd
-import networkx as nx
 from collections import deque
+import numpy as np
+import scipy.sparse as sp
 from .base_computer import *
+from .monte_carlo_pagerank import MonteCarloPageRank
 
 class StaticPageRankParams():
-    def __init__(self,lookback_cnt=0,alpha=0.85,max_iter=100):
+    def __init__(self,lookback_cnt=0,alpha=0.85,max_iter=100,walks_per_node=None):
+        """The scores are computed by power iteration if 'walks_per_node'=None, otherwise they are estimated incrementally from 'walks_per_node' random walks per node (see MonteCarloPageRank)."""
         self.max_iter = max_iter
+        if walks_per_node != None and walks_per_node < 1:
+            raise RuntimeError("'walks_per_node' must be positive!")
+        self.walks_per_node = walks_per_node
         self.lookback_cnt = lookback_cnt
         if alpha > 0 and alpha < 1:
             self.alpha = alpha
@@ -19,40 +23,92 @@ class StaticPageRankParams():
             self.graph_type = "total"
         
     def __str__(self):
-        return "spr_%s_a%0.2f_i%i" % (self.graph_type,self.alpha,self.max_iter)
+        if self.walks_per_node == None:
+            return "spr_%s_a%0.2f_i%i" % (self.graph_type,self.alpha,self.max_iter)
+        else:
+            return "spr_%s_a%0.2f_mc%i" % (self.graph_type,self.alpha,self.walks_per_node)
 
     
+def get_transition_matrix(view):
+    """Return the transposed row-stochastic transition matrix of the window graph and the indices of its dangling nodes"""
+    out_deg = np.diff(view.indptr)
+    Q = sp.csr_matrix((1.0 / out_deg[view.src_indices], view.indices, view.indptr), shape=(len(view),len(view)))
+    return Q.T.tocsr(), np.flatnonzero(out_deg == 0)
+
+def power_iteration(transition_T, dangling, alpha, max_iter, x0=None, tol=1e-6):
+    """PageRank power iteration as in networkx: the rank of the dangling nodes is distributed uniformly and the iteration stops when the L1 change is below 'tol' times the number of nodes. Returns the rank vector, the number of iterations and the last residual."""
+    N = transition_T.shape[0]
+    p = np.repeat(1.0 / N, N)
+    x = p if x0 is None else x0 / x0.sum()
+    for iteration in range(1, max_iter+1):
+        x_last = x
+        x = alpha * (transition_T.dot(x) + x[dangling].sum() * p) + (1 - alpha) * p
+        residual = np.absolute(x - x_last).sum()
+        if residual < N * tol:
+            return x, iteration, residual
+    raise RuntimeError("PageRank power iteration failed to converge in %i iterations!" % max_iter)
+
 class StaticPageRankComputer(BaseComputer):
-    def __init__(self,param_list):
-        """Input: list of StaticPageRankParams objects"""
+    # static measures only read the graphs at snapshot time
+    coalescable = True
+    pipelinable = True
+    
+    def __init__(self,param_list,warm_start=False,seed=0,max_stats=100):
+        """Input: list of StaticPageRankParams objects. If 'warm_start'=True then the power iteration of each parameter starts from its scores in the previous snapshot (new nodes start from 1/N): it needs fewer iterations, but the scores differ from the cold start within the tolerance of the iteration. 'seed' initializes the random walks of the Monte Carlo parameters. The convergence statistics of the last 'max_stats' snapshots are kept."""
         self.param_list = param_list
-        self.graph_snapshots = [deque([]) for i in range(len(self.param_list))]
+        self.warm_start = warm_start
         self.stat_pr = None
+        # (iterations, residual) of each parameter in the last snapshots (None for Monte Carlo parameters)
+        self.convergence_stats = deque([], maxlen=max_stats)
+        self.walk_engines = dict((i, MonteCarloPageRank(param.alpha, param.walks_per_node, seed=seed+i)) for i, param in enumerate(param_list) if param.walks_per_node != None)
+        
+    def get_graph_requirements(self):
+        """Every parameter reads a view of the shared edge window"""
+        return set([EDGE_WINDOW])
+    
+    def get_lookback_counts(self):
+        return [param.lookback_cnt for param in self.param_list]
         
     def update(self,edge,graph,snapshot_graph,time=None):
         """edge=(src,trg)"""
         # This is a static measure. It only needs to be updated at snapshot update
         pass
+
+    def update_coalesced(self,src_ids,trg_ids,multiplicities,time=None,graph=None,snapshot_graph=None):
+        pass
+    
+    def get_start_vector(self,view,i):
+        """Scores of the nodes of the view in the previous snapshot for parameter 'i'"""
+        if not self.warm_start or self.stat_pr is None or len(self.stat_pr) == 0:
+            return None
+        prev_ids, prev_scores = self.stat_pr[:,0], self.stat_pr[:,i+1]
+        idx = np.minimum(np.searchsorted(prev_ids, view.node_ids), len(prev_ids)-1)
+        x0 = np.where(prev_ids[idx] == view.node_ids, prev_scores[idx], 0.0)
+        x0[x0 == 0.0] = 1.0 / len(view)
+        return x0
     
-    def calculate_pageranks(self,graph,snapshot_graph):
-        pr_df = pd.DataFrame()
+    def calculate_pageranks(self,snapshot_graph):
+        views, rows, pr_mx = init_window_scores(snapshot_graph, self.param_list)
+        # parameters with the same window share the transition matrix
+        transitions = {}
+        stats = []
         for i in range(len(self.param_list)):
-            param = self.param_list[i]
-            G = nx.DiGraph(graph) if param.lookback_cnt == 0 else get_graph_from_snapshots(self, snapshot_graph, param, i)
-            pr_scores = nx.pagerank(G,alpha=param.alpha,max_iter=param.max_iter) 
-            new_col_df = pd.DataFrame({str(i):pd.Series(pr_scores)})
-            pr_df = pr_df.join(new_col_df, how='outer')
-        pr_df.insert(0,"node_id",pr_df.index)
-        return pr_df.fillna(0.0).as_matrix()
+            param, view = self.param_list[i], views[i]
+            if len(view) == 0:
+                stats.append((0, 0.0))
+                continue
+            if i in self.walk_engines:
+                pr_mx[rows[i],i+1] = self.walk_engines[i].update(view)
+                stats.append(None)
+                continue
+            if not param.lookback_cnt in transitions:
+                transitions[param.lookback_cnt] = get_transition_matrix(view)
+            transition_T, dangling = transitions[param.lookback_cnt]
+            pr_mx[rows[i],i+1], iterations, residual = power_iteration(transition_T, dangling, param.alpha, param.max_iter, x0=self.get_start_vector(view,i))
+            stats.append((iterations, residual))
+        self.convergence_stats.append(stats)
+        return pr_mx
         
-    def save_snapshot(self,experiment_folder,snapshot_index,graph,snapshot_graph,time=None):
-        self.stat_pr = self.calculate_pageranks(graph,snapshot_graph)
-        if not os.path.exists(experiment_folder):
-            os.makedirs(experiment_folder)
-        for j, param in enumerate(self.param_list):
-            output_folder = "%s/%s" % (experiment_folder,param)
-            if not os.path.exists(output_folder):
-                os.makedirs(output_folder)
-            pos_idx = self.stat_pr[:,j+1] > 0 
-            active_arr = self.stat_pr[pos_idx][:,[0,j+1]]
-            scores2file(active_arr,"%s/spr_%i.csv" % (output_folder,snapshot_index))
+    def get_snapshot(self,time=None,graph=None,snapshot_graph=None):
+        self.stat_pr = self.calculate_pageranks(snapshot_graph)
+        return ScoreSnapshot("spr",self.stat_pr[:,0],self.stat_pr[:,1:],self.param_list,positive_only=True)
@@ -2,6 +2,7 @@ import os
 import numpy as np
 from .base_computer import *
 from .weight_funtions import *
+from .node_registry import NodeRegistry, NodeActivity
 
 class TemporalKatzParams():
     def __init__(self,beta,weight_function):
@@ -14,52 +15,161 @@ class TemporalKatzParams():
     def __str__(self):
         return "tk_b%0.2f_%s" % (self.beta,str(self.weight_func))
 
+class LandmarkScaler():
+    """Exponential decay with a landmark time. Scores are stored multiplied by exp(rate*(time-landmark_time)), so the decay of a node is implicit until the scores are exported."""
+    def __init__(self,weight_bank,max_log_scale=256*np.log(2)):
+        self.decay_rates = weight_bank.get_exponential_decay_rates()
+        self.max_log_scale = max_log_scale
+        self.landmark_time = None
+        self.scale_time, self.scale = None, None
+        
+    def set_landmark(self,time):
+        self.landmark_time = time
+        self.scale_time, self.scale = None, None
+        
+    def needs_renormalization(self,time):
+        """Stored values must be rescaled to a new landmark before the scale factor could overflow"""
+        return self.landmark_time != None and np.max(self.decay_rates) * (time - self.landmark_time) > self.max_log_scale
+        
+    def get_scale(self,time):
+        """Multiplier from current scores to landmark scaled values"""
+        if self.landmark_time == None:
+            self.set_landmark(time)
+        if time != self.scale_time:
+            self.scale_time, self.scale = time, np.exp(self.decay_rates * (time - self.landmark_time))
+        return self.scale
+    
+    def get_decay(self,time):
+        """Multiplier from landmark scaled values to current scores"""
+        if self.landmark_time == None:
+            return np.ones(len(self.decay_rates))
+        return np.exp(-self.decay_rates * (time - self.landmark_time))
+
 class TemporalKatzComputer(BaseComputer):
-    """General temporal Katz centrality implementation"""
-    def __init__(self,nodes,param_list):
+    """General temporal Katz centrality implementation. Set 'use_landmark=True' to store landmark scaled scores (only for ExponentialWeighter parameters). Then neither 'update' nor the snapshot export has to decay individual nodes. 'nodes' can be None: unseen nodes are registered in the (optionally shared) NodeRegistry on arrival."""
+    coalescable = True
+    
+    def __init__(self,nodes,param_list,use_landmark=False,registry=None):
         self.param_list = param_list
-        self.num_of_nodes = len(nodes)
-        self.node_indexes = dict(zip(nodes,range(self.num_of_nodes)))
-        self.ranks = np.zeros((self.num_of_nodes,len(self.param_list)))
-        self.node_last_activation = {}
+        self.registry = NodeRegistry() if registry == None else registry
+        if nodes is not None:
+            self.registry.add_nodes(nodes)
+        self.node_indexes = self.registry.node_indexes
+        self.ranks = self.registry.allocate(len(self.param_list))
+        self.beta_vector = np.array([param.beta for param in self.param_list])
+        self.weight_bank = WeightBank(self.param_list)
+        self.landmark = LandmarkScaler(self.weight_bank) if use_landmark else None
+        self.node_last_activation = NodeActivity(self.registry)
         
-    def get_updated_node_rank(self,time,node_id):
-        node_index = self.node_indexes[node_id]
+    def get_node_index(self,node_id):
+        node_index = self.registry.get_index(node_id)
+        if node_index >= len(self.ranks):
+            self.ranks = self.registry.fit(self.ranks)
+            self.node_last_activation.fit()
+        return node_index
+        
+    def get_decayed_rank(self,node_index,time):
         updated_ranks = self.ranks[node_index,:] # zero vector if node did not appear before
-        if node_id in self.node_last_activation:
-            delta_time = time - self.node_last_activation[node_id]
-            time_decaying_weights = [param.weight_func.weight(delta_time) for param in self.param_list]
-            updated_ranks *= time_decaying_weights
-        return node_index, updated_ranks
+        if self.landmark != None:
+            updated_ranks = updated_ranks * self.landmark.get_decay(time)
+        elif self.node_last_activation.is_active[node_index]:
+            delta_time = time - self.node_last_activation.last_activation[node_index]
+            # decayed copy: the stored rank is only overwritten by 'update'
+            updated_ranks = updated_ranks * self.weight_bank.weights(delta_time)
+        return updated_ranks
+        
+    def get_updated_node_rank(self,time,node_id):
+        node_index = self.get_node_index(node_id)
+        return node_index, self.get_decayed_rank(node_index,time)
     
     def get_all_updated_node_ranks(self,time):
-        updated_scores = []
-        for node in self.node_last_activation:
-            node_index, node_rank = self.get_updated_node_rank(time,node)
-            row = [node] + list(node_rank)
-            updated_scores.append(row)
-        return np.array(updated_scores)
+        node_indices = self.node_last_activation.get_active_indices()
+        if self.landmark != None:
+            updated_ranks = self.ranks[node_indices,:] * self.landmark.get_decay(time)
+        else:
+            delta_times = time - self.node_last_activation.last_activation[node_indices]
+            updated_ranks = self.ranks[node_indices,:] * self.weight_bank.weights(delta_times)
+        return np.column_stack((self.registry.get_node_ids(node_indices).astype(np.float64),updated_ranks))
     
+    def get_graph_requirements(self):
+        return set()
+        
     def update(self,edge,time,graph=None,snapshot_graph=None):
-        src, trg = int(edge[0]), int(edge[1])
-        beta_vector = [param.beta for param in self.param_list]
-        src_index, src_rank = self.get_updated_node_rank(time,src)
-        trg_index, trg_rank = self.get_updated_node_rank(time,trg)
+        src_index, trg_index = self.get_node_index(int(edge[0])), self.get_node_index(int(edge[1]))
+        if self.landmark != None:
+            self.update_with_landmark(src_index,trg_index,time)
+        else:
+            self.update_with_decay(src_index,trg_index,time)
+        self.node_last_activation.activate(src_index,time)
+        self.node_last_activation.activate(trg_index,time)
+        
+    def update_source(self,src_id,time):
+        """Source half of 'update' for an edge whose target is updated by another computer (see ShardedTemporalKatzComputer). Returns the source rank that 'update_target' needs. The renormalization of the landmark is left to the caller."""
+        src_index = self.get_node_index(src_id)
+        if self.landmark != None:
+            src_rank = self.ranks[src_index,:].copy()
+        else:
+            # the rank of an inactive node is a view of its row, it must not change with later updates of the node
+            src_rank = self.get_decayed_rank(src_index,time).copy()
+            self.ranks[src_index,:] = src_rank
+        self.node_last_activation.activate(src_index,time)
+        return src_rank
+        
+    def update_target(self,trg_id,src_rank,time):
+        """Target half of 'update' with the source rank returned by 'update_source'"""
+        trg_index = self.get_node_index(trg_id)
+        if self.landmark != None:
+            self.ranks[trg_index,:] += self.beta_vector * (src_rank + self.landmark.get_scale(time))
+        else:
+            trg_rank = self.get_decayed_rank(trg_index,time)
+            self.ranks[trg_index,:] = trg_rank + self.beta_vector * (src_rank + 1)
+        self.node_last_activation.activate(trg_index,time)
+        
+    def renormalize(self,time):
+        """Rescale the stored ranks to a new landmark at 'time'"""
+        self.ranks *= self.landmark.get_decay(time)
+        self.landmark.set_landmark(time)
+        
+    def decay_rows(self,node_indices,time):
+        """Decay the stored ranks of the given nodes to 'time' in place"""
+        node_indices = np.unique(node_indices)
+        node_indices = node_indices[self.node_last_activation.is_active[node_indices]]
+        delta_times = time - self.node_last_activation.last_activation[node_indices]
+        self.ranks[node_indices,:] = self.ranks[node_indices,:] * self.weight_bank.weights(delta_times)
+        
+    def update_coalesced(self,src_ids,trg_ids,multiplicities,time=None,graph=None,snapshot_graph=None):
+        """Closed form update with the distinct edges of one timestamp and their multiplicities. The edges are treated as simultaneous: each target is extended by the ranks of its sources from before the timestamp. It equals sequential processing (up to rounding) unless a source of the timestamp is also a target of an earlier edge (or a self-loop) with the same timestamp, as sequential processing chains those walks."""
+        # endpoints are registered in the same order as in sequential processing
+        edge_indices = np.array([(self.get_node_index(int(src)),self.get_node_index(int(trg))) for src, trg in zip(src_ids,trg_ids)], dtype=np.int64).reshape(-1,2)
+        src_indices, trg_indices = edge_indices[:,0], edge_indices[:,1]
+        if self.landmark != None:
+            if self.landmark.needs_renormalization(time):
+                self.ranks *= self.landmark.get_decay(time)
+                self.landmark.set_landmark(time)
+            walk_ranks = self.ranks[src_indices,:] + self.landmark.get_scale(time)
+        else:
+            self.decay_rows(np.concatenate((src_indices,trg_indices)),time)
+            walk_ranks = self.ranks[src_indices,:] + 1
+        counts = np.asarray(multiplicities, dtype=np.float64)[:,np.newaxis]
+        np.add.at(self.ranks, trg_indices, counts * (self.beta_vector * walk_ranks))
+        self.node_last_activation.activate(src_indices,time)
+        self.node_last_activation.activate(trg_indices,time)
+        
+    def update_with_landmark(self,src_index,trg_index,time):
+        if self.landmark.needs_renormalization(time):
+            self.ranks *= self.landmark.get_decay(time)
+            self.landmark.set_landmark(time)
+        self.ranks[trg_index,:] += self.beta_vector * (self.ranks[src_index,:] + self.landmark.get_scale(time))
+        
+    def update_with_decay(self,src_index,trg_index,time):
+        src_rank = self.get_decayed_rank(src_index,time)
+        trg_rank = self.get_decayed_rank(trg_index,time)
         self.ranks[src_index,:] = src_rank
-        self.ranks[trg_index,:] = trg_rank + beta_vector * (src_rank + 1) # +1 is for 1 length path
-        self.node_last_activation[src] = time
-        self.node_last_activation[trg] = time
+        self.ranks[trg_index,:] = trg_rank + self.beta_vector * (src_rank + 1) # +1 is for 1 length path
         
-    def save_snapshot(self,experiment_folder,snapshot_index,time,graph=None,snapshot_graph=None):
-        if not os.path.exists(experiment_folder):
-            os.makedirs(experiment_folder)
+    def get_snapshot(self,time=None,graph=None,snapshot_graph=None):
         all_nodes_updated = self.get_all_updated_node_ranks(time)
-        for j, param in enumerate(self.param_list):
-            output_folder = "%s/%s" % (experiment_folder,param)
-            if not os.path.exists(output_folder):
-                os.makedirs(output_folder)
-            active_arr = all_nodes_updated[:,[0,j+1]]
-            scores2file(active_arr,"%s/tk_%i.csv" % (output_folder,snapshot_index))
+        return ScoreSnapshot("tk",all_nodes_updated[:,0],all_nodes_updated[:,1:],self.param_list)
         
 
 class TruncatedTemporalKatzParams():
@@ -74,57 +184,110 @@ class TruncatedTemporalKatzParams():
         return "ttk_b%0.2f_%s" % (self.beta,str(self.weight_func))
 
 class TruncatedTemporalKatzComputer(BaseComputer):
-    """Truncated temporal Katz centrality implementation"""
-    def __init__(self,nodes,param_list,k=5):
+    """Truncated temporal Katz centrality implementation. The scores of all length limits are stored in one (nodes x k x params) tensor, where layer 'l' contains the scores of walks with length at most l+1. Set 'use_landmark=True' to store landmark scaled scores (only for ExponentialWeighter parameters). 'nodes' can be None: unseen nodes are registered in the (optionally shared) NodeRegistry on arrival."""
+    coalescable = True
+    
+    def __init__(self,nodes,param_list,k=5,use_landmark=False,registry=None):
         self.k = k
         self.param_list = param_list
-        self.num_of_nodes = len(nodes)
-        self.node_indexes = dict(zip(nodes,range(self.num_of_nodes)))
-        self.ranks = [np.zeros((self.num_of_nodes,len(self.param_list))) for i in range(k)]
-        self.beta_vector = [param.beta for param in self.param_list]
-        self.node_last_activation = {}
-        
-    def get_updated_node_rank(self,layer_idx,time,node_id):
-        node_index = self.node_indexes[node_id]
-        updated_ranks = self.ranks[layer_idx][node_index,:] # zero vector if node did not appear before
-        if node_id in self.node_last_activation:
-            delta_time = time - self.node_last_activation[node_id]
-            time_decaying_weights = [param.weight_func.weight(delta_time) for param in self.param_list]
-            updated_ranks *= time_decaying_weights
-        return node_index, updated_ranks
+        self.registry = NodeRegistry() if registry == None else registry
+        if nodes is not None:
+            self.registry.add_nodes(nodes)
+        self.node_indexes = self.registry.node_indexes
+        # node-major layout: one node touch reads and writes a contiguous (k x params) block
+        self.ranks = np.zeros((self.registry.capacity,k,len(self.param_list)))
+        self.beta_vector = np.array([param.beta for param in self.param_list])
+        self.weight_bank = WeightBank(self.param_list)
+        self.landmark = LandmarkScaler(self.weight_bank) if use_landmark else None
+        self.node_last_activation = NodeActivity(self.registry)
+        
+    def get_node_index(self,node_id):
+        node_index = self.registry.get_index(node_id)
+        if node_index >= len(self.ranks):
+            self.ranks = self.registry.fit(self.ranks)
+            self.node_last_activation.fit()
+        return node_index
+        
+    def get_decayed_rank(self,node_index,time):
+        """Return the decayed scores of the node for every length limit as a (k x params) matrix"""
+        updated_ranks = self.ranks[node_index] # zero matrix if node did not appear before
+        if self.landmark != None:
+            updated_ranks = updated_ranks * self.landmark.get_decay(time)
+        elif self.node_last_activation.is_active[node_index]:
+            delta_time = time - self.node_last_activation.last_activation[node_index]
+            # one decay vector is shared by every layer
+            updated_ranks = updated_ranks * self.weight_bank.weights(delta_time)
+        return updated_ranks
+        
+    def get_updated_node_rank(self,time,node_id):
+        node_index = self.get_node_index(node_id)
+        return node_index, self.get_decayed_rank(node_index,time)
     
-    def get_all_updated_node_ranks(self,layer_idx,time):
-        updated_scores = []
-        for node in self.node_last_activation:
-            node_index, node_rank = self.get_updated_node_rank(layer_idx,time,node)
-            row = [node] + list(node_rank)
-            updated_scores.append(row)
-        return np.array(updated_scores)
+    def get_all_updated_node_ranks(self,time):
+        """Return the active nodes and their decayed scores as an (active nodes x k x params) tensor"""
+        node_indices = self.node_last_activation.get_active_indices()
+        if self.landmark != None:
+            updated_ranks = self.ranks[node_indices] * self.landmark.get_decay(time)
+        else:
+            delta_times = time - self.node_last_activation.last_activation[node_indices]
+            updated_ranks = self.ranks[node_indices] * self.weight_bank.weights(delta_times)[:,np.newaxis,:]
+        return self.registry.get_node_ids(node_indices).astype(np.float64), updated_ranks
     
+    def get_graph_requirements(self):
+        return set()
+        
     def update(self,edge,time,graph=None,snapshot_graph=None):
-        src, trg = int(edge[0]), int(edge[1])
-        # update each layer
-        for layer_idx in list(reversed(range(0,self.k))):
-            if layer_idx == 0:
-                src_rank_shorter = np.zeros(len(self.param_list))
-            else:
-                _, src_rank_shorter = self.get_updated_node_rank(layer_idx-1,time,src)
-            src_index, src_rank = self.get_updated_node_rank(layer_idx,time,src)
-            trg_index, trg_rank = self.get_updated_node_rank(layer_idx,time,trg)
-            self.ranks[layer_idx][src_index,:] = src_rank
-            self.ranks[layer_idx][trg_index,:] = trg_rank + self.beta_vector * (src_rank_shorter + 1) # +1 is for 1 length path
-        self.node_last_activation[src] = time
-        self.node_last_activation[trg] = time
-        
-    def save_snapshot(self,experiment_folder,snapshot_index,time,graph,snapshot_graph=None):
+        src_index, trg_index = self.get_node_index(int(edge[0])), self.get_node_index(int(edge[1]))
+        if self.landmark != None:
+            self.update_with_landmark(src_index,trg_index,time)
+        else:
+            self.update_with_decay(src_index,trg_index,time)
+        self.node_last_activation.activate(src_index,time)
+        self.node_last_activation.activate(trg_index,time)
+        
+    def decay_rows(self,node_indices,time):
+        """Decay the stored ranks of the given nodes to 'time' in place"""
+        node_indices = np.unique(node_indices)
+        node_indices = node_indices[self.node_last_activation.is_active[node_indices]]
+        delta_times = time - self.node_last_activation.last_activation[node_indices]
+        self.ranks[node_indices] = self.ranks[node_indices] * self.weight_bank.weights(delta_times)[:,np.newaxis,:]
+        
+    def update_coalesced(self,src_ids,trg_ids,multiplicities,time=None,graph=None,snapshot_graph=None):
+        """Closed form update with the distinct edges of one timestamp and their multiplicities. The edges are treated as simultaneous, see TemporalKatzComputer.update_coalesced for the difference from sequential processing."""
+        # endpoints are registered in the same order as in sequential processing
+        edge_indices = np.array([(self.get_node_index(int(src)),self.get_node_index(int(trg))) for src, trg in zip(src_ids,trg_ids)], dtype=np.int64).reshape(-1,2)
+        src_indices, trg_indices = edge_indices[:,0], edge_indices[:,1]
+        if self.landmark != None:
+            if self.landmark.needs_renormalization(time):
+                self.ranks *= self.landmark.get_decay(time)
+                self.landmark.set_landmark(time)
+            walk_ranks = self.get_shorter_ranks(self.ranks[src_indices]) + self.landmark.get_scale(time)
+        else:
+            self.decay_rows(np.concatenate((src_indices,trg_indices)),time)
+            walk_ranks = self.get_shorter_ranks(self.ranks[src_indices]) + 1
+        counts = np.asarray(multiplicities, dtype=np.float64)[:,np.newaxis,np.newaxis]
+        np.add.at(self.ranks, trg_indices, counts * (self.beta_vector * walk_ranks))
+        self.node_last_activation.activate(src_indices,time)
+        self.node_last_activation.activate(trg_indices,time)
+        
+    def get_shorter_ranks(self,src_rank):
+        """Shift the layers of the source: layer 'l' of the target is extended by walks of layer 'l-1' of the source. It also works for a stack of sources."""
+        return np.concatenate((np.zeros_like(src_rank[...,:1,:]),src_rank[...,:-1,:]), axis=-2)
+        
+    def update_with_landmark(self,src_index,trg_index,time):
+        if self.landmark.needs_renormalization(time):
+            self.ranks *= self.landmark.get_decay(time)
+            self.landmark.set_landmark(time)
+        self.ranks[trg_index] += self.beta_vector * (self.get_shorter_ranks(self.ranks[src_index]) + self.landmark.get_scale(time))
+        
+    def update_with_decay(self,src_index,trg_index,time):
+        src_rank = self.get_decayed_rank(src_index,time)
+        trg_rank = self.get_decayed_rank(trg_index,time)
+        self.ranks[src_index] = src_rank
+        self.ranks[trg_index] = trg_rank + self.beta_vector * (self.get_shorter_ranks(src_rank) + 1) # +1 is for 1 length path
+        
+    def get_snapshot(self,time=None,graph=None,snapshot_graph=None):
         """Exports every truncated score with maximum length from 1 to k"""
-        if not os.path.exists(experiment_folder):
-            os.makedirs(experiment_folder)
-        for layer_idx in list(reversed(range(0,self.k))):
-            all_nodes_updated = self.get_all_updated_node_ranks(layer_idx,time)
-            for j, param in enumerate(self.param_list):
-                output_folder = "%s/%s_length_limit_%i" % (experiment_folder,param,layer_idx+1)
-                if not os.path.exists(output_folder):
-                    os.makedirs(output_folder)
-                active_arr = all_nodes_updated[:,[0,j+1]]
-                scores2file(active_arr,"%s/ttk_%i.csv" % (output_folder,snapshot_index))
\ No newline at end of file
+        active_nodes, all_nodes_updated = self.get_all_updated_node_ranks(time)
+        columns = ["%s_length_limit_%i" % (param,layer_idx+1) for layer_idx in range(self.k) for param in self.param_list]
+        return ScoreSnapshot("ttk",active_nodes,all_nodes_updated.reshape(len(active_nodes),-1),columns)
@@ -1,6 +1,7 @@
 import os
 import numpy as np
 from .base_computer import *
+from .node_registry import NodeRegistry
 
 class TemporalPageRankParams():
     def __init__(self,alpha,beta):
@@ -18,46 +19,72 @@ class TemporalPageRankParams():
 
     
 class TemporalPageRankComputer(BaseComputer):
-    def __init__(self,nodes,param_list):
-        """Input: list of TemporalPageRankParams objects"""
+    def __init__(self,nodes,param_list,registry=None):
+        """Input: list of TemporalPageRankParams objects. 'nodes' can be None: unseen nodes are registered in the (optionally shared) NodeRegistry on arrival."""
         self.param_list = param_list
-        self.num_of_nodes = len(nodes)
-        self.node_indexes = dict(zip(nodes,range(self.num_of_nodes)))
-        self.active_mass = np.zeros((self.num_of_nodes,len(self.param_list)+1))
-        self.active_mass[:,0] = nodes
-        self.temp_pr = np.zeros((self.num_of_nodes,len(self.param_list)+1))
-        self.temp_pr[:,0] = nodes
+        self.registry = NodeRegistry() if registry == None else registry
+        if nodes is not None:
+            self.registry.add_nodes(nodes)
+        self.node_indexes = self.registry.node_indexes
+        self.active_mass = self.registry.allocate(len(self.param_list))
+        self.temp_pr = self.registry.allocate(len(self.param_list))
+        self.alpha_vector = np.array([param.alpha for param in self.param_list])
+        self.beta_vector = np.array([param.beta for param in self.param_list])
+        self.restart_vector = 1.0 * (1.0 - self.alpha_vector)
+        
+    def get_node_index(self,node_id):
+        node_index = self.registry.get_index(node_id)
+        if node_index >= len(self.temp_pr):
+            self.active_mass = self.registry.fit(self.active_mass)
+            self.temp_pr = self.registry.fit(self.temp_pr)
+        return node_index
     
+    def get_graph_requirements(self):
+        return set()
+        
     def update(self,edge,time=None,graph=None,snapshot_graph=None):
         """edge=(src,trg)"""
         src, trg = edge
-        for i in range(0,len(self.param_list)):
-            param = self.param_list[i]
-            edge_source_index, edge_target_index = self.node_indexes[src], self.node_indexes[trg]
-            self.temp_pr[edge_source_index,i+1], self.temp_pr[edge_target_index,i+1], self.active_mass[edge_source_index,i+1], self.active_mass[edge_target_index,i+1] = self.update_with_param(i+1,src,trg,param)
-            
-    def update_with_param(self,idx,src,trg,param):
-        "apply temporal pagerank update rule"
-        alpha, beta = param.alpha, param.beta
-        edge_source_index, edge_target_index = self.node_indexes[src], self.node_indexes[trg]
-        tpr_src = self.temp_pr[edge_source_index,idx]
-        tpr_trg = self.temp_pr[edge_target_index,idx]
-        mass_src = self.active_mass[edge_source_index,idx]
-        mass_trg = self.active_mass[edge_target_index,idx]
-        # update formula
-        tpr_src = tpr_src + 1.0 * (1.0 - alpha)
-        tpr_trg = tpr_trg + (mass_src + 1.0 * (1.0 - alpha)) * alpha
-        mass_trg = mass_trg + (mass_src + 1.0 * (1.0 - alpha)) * alpha * (1 - beta)
-        mass_src = mass_src * beta
-        return tpr_src, tpr_trg, mass_src, mass_trg
-        
-    def save_snapshot(self,experiment_folder,snapshot_index,time=None,graph=None,snapshot_graph=None):
-        if not os.path.exists(experiment_folder):
-            os.makedirs(experiment_folder)
-        for j, param in enumerate(self.param_list):
-            output_folder = "%s/%s" % (experiment_folder,param)
-            if not os.path.exists(output_folder):
-                os.makedirs(output_folder)
-            pos_idx = self.temp_pr[:,j+1] > 0 
-            active_arr = self.temp_pr[pos_idx][:,[0,j+1]]
-            scores2file(active_arr,"%s/tpr_%i.csv" % (output_folder,snapshot_index))
+        self.update_rows(self.get_node_index(src), self.get_node_index(trg))
+        
+    def update_rows(self,src_index,trg_index):
+        """apply temporal pagerank update rule for every parameter at once (indices can be arrays of distinct nodes)"""
+        tpr_src = self.temp_pr[src_index] + self.restart_vector
+        mass_flow = (self.active_mass[src_index] + self.restart_vector) * self.alpha_vector
+        tpr_trg = self.temp_pr[trg_index] + mass_flow
+        mass_trg = self.active_mass[trg_index] + mass_flow * (1 - self.beta_vector)
+        mass_src = self.active_mass[src_index] * self.beta_vector
+        # for self-loops the target values are written last
+        self.temp_pr[src_index], self.temp_pr[trg_index] = tpr_src, tpr_trg
+        self.active_mass[src_index], self.active_mass[trg_index] = mass_src, mass_trg
+        
+    def update_many(self,src_ids,trg_ids,time=None,graph=None,snapshot_graph=None):
+        """Process a batch of edges in the given order. The batch is split into runs in which no node occurs twice, and each run is updated with vectorized operations."""
+        src_indices = [self.get_node_index(src) for src in src_ids]
+        trg_indices = [self.get_node_index(trg) for trg in trg_ids]
+        run_start, run_nodes = 0, set()
+        for i in range(len(src_indices)):
+            src_index, trg_index = src_indices[i], trg_indices[i]
+            if src_index in run_nodes or trg_index in run_nodes or src_index == trg_index:
+                self.update_run(src_indices[run_start:i], trg_indices[run_start:i])
+                run_start, run_nodes = i, set()
+            run_nodes.add(src_index)
+            run_nodes.add(trg_index)
+            if src_index == trg_index:
+                self.update_rows(src_index, trg_index)
+                run_start, run_nodes = i+1, set()
+        self.update_run(src_indices[run_start:], trg_indices[run_start:])
+        
+    def update_run(self,src_indices,trg_indices):
+        if len(src_indices) == 1:
+            self.update_rows(src_indices[0], trg_indices[0])
+        elif len(src_indices) > 1:
+            self.update_rows(np.array(src_indices), np.array(trg_indices))
+        
+    def get_snapshot(self,time=None,graph=None,snapshot_graph=None):
+        # a shared registry may have been grown by other computers
+        self.active_mass = self.registry.fit(self.active_mass)
+        self.temp_pr = self.registry.fit(self.temp_pr)
+        num_of_nodes = self.registry.num_of_nodes
+        return ScoreSnapshot("tpr",self.registry.get_node_ids(),self.temp_pr[:num_of_nodes],self.param_list,positive_only=True)
+        
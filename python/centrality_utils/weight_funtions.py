@@ -1,7 +1,11 @@
-import math
+import numpy as np
 
 ### Weight function objects ###
 
+def as_delta_array(x):
+	"""Time deltas as a float array with at least one dimension. NumPy scalar arithmetic can round differently than the array kernels, so scalars are evaluated as 1-element arrays."""
+	return np.atleast_1d(np.asarray(x, dtype=np.float64))
+
 class ConstantWeighter:
 	def __init__(self, c=1):
 		self.c = c
@@ -9,6 +13,10 @@ class ConstantWeighter:
 	def weight(self, x):
 		return self.c
 
+	def weights(self, x):
+		"""Vectorized version of 'weight' for a scalar or an array of time deltas"""
+		return np.full(np.shape(x), float(self.c))
+
 	def __repr__(self):
 		return 'Const(%.2f)' % self.c
 
@@ -19,7 +27,11 @@ class PowerWeighter:
 		self.exponent, self.norm = exponent, norm
 
 	def weight(self, x):
-		return math.pow(1 + float(x)/self.norm, self.exponent)
+		return float(self.weights(x))
+
+	def weights(self, x):
+		"""Vectorized version of 'weight' for a scalar or an array of time deltas"""
+		return np.power(1 + as_delta_array(x)/self.norm, self.exponent).reshape(np.shape(x))
 
 	def __repr__(self):
 		return 'Pow(e:%.3f,n:%.3f)' % (self.exponent, self.norm)
@@ -31,7 +43,11 @@ class ExponentialWeighter:
 		self.base, self.norm = base, norm
 
 	def weight(self, x):
-		return math.pow(self.base, float(x)/self.norm)
+		return float(self.weights(x))
+
+	def weights(self, x):
+		"""Vectorized version of 'weight' for a scalar or an array of time deltas"""
+		return np.power(self.base, as_delta_array(x)/self.norm).reshape(np.shape(x))
 
 	def __repr__(self):
 		return 'Exp(b:%.3f,n:%.3f)' % (self.base, self.norm)
@@ -43,8 +59,71 @@ class RayleighWeighter:
 		self.var = self.sigma**2
 
 	def weight(self, x):
-		val = float(x) / self.norm
-		return (1.0/self.var) * val * math.exp(-1.0 * val**2 / (2*self.var))
+		return float(self.weights(x))
+
+	def weights(self, x):
+		"""Vectorized version of 'weight' for a scalar or an array of time deltas"""
+		val = as_delta_array(x) / self.norm
+		return ((1.0/self.var) * val * np.exp(-1.0 * val**2 / (2*self.var))).reshape(np.shape(x))
 
 	def __repr__(self):
 		return 'Ray(s%.3f,n:%.3f)' % (self.sigma, self.norm)
+
+
+### Weight function bank ###
+
+class WeightBank:
+	"""Evaluates the weight functions of several parameters at once. The input list may contain weight function objects or parameter objects with a 'weight_func' member (e.g. TemporalKatzParams). Weight functions of the same type are evaluated with a single NumPy call, and the result is bit-identical to calling 'weight' for each parameter separately."""
+	def __init__(self, param_list):
+		self.weight_funcs = [getattr(param, "weight_func", param) for param in param_list]
+		self.num_of_params = len(self.weight_funcs)
+		self.groups = []
+		for weighter_type in [ConstantWeighter, PowerWeighter, ExponentialWeighter, RayleighWeighter]:
+			columns = [j for j, wf in enumerate(self.weight_funcs) if type(wf) == weighter_type]
+			if len(columns) > 0:
+				self.groups.append((weighter_type, np.array(columns), self._get_coefficients(weighter_type, columns)))
+		known_columns = set(j for _, columns, _ in self.groups for j in columns)
+		# weight functions without a vectorized implementation fall back to their scalar 'weight' method
+		self.custom_columns = [j for j in range(self.num_of_params) if not j in known_columns]
+
+	def _get_coefficients(self, weighter_type, columns):
+		wfs = [self.weight_funcs[j] for j in columns]
+		if weighter_type == ConstantWeighter:
+			return np.array([float(wf.c) for wf in wfs])
+		elif weighter_type == PowerWeighter:
+			return np.array([wf.norm for wf in wfs], dtype=np.float64), np.array([wf.exponent for wf in wfs], dtype=np.float64)
+		elif weighter_type == ExponentialWeighter:
+			return np.array([wf.norm for wf in wfs], dtype=np.float64), np.array([wf.base for wf in wfs], dtype=np.float64)
+		else:
+			return np.array([wf.norm for wf in wfs], dtype=np.float64), np.array([wf.var for wf in wfs], dtype=np.float64)
+
+	def weights(self, deltas):
+		"""Return the decay factor of every parameter. For a scalar time delta the result is a vector of length 'num_of_params', for an array of time deltas it is a (len(deltas), num_of_params) matrix."""
+		is_scalar = (np.ndim(deltas) == 0)
+		x = as_delta_array(deltas).reshape(-1,1)
+		res = np.empty((len(x),self.num_of_params))
+		for weighter_type, columns, coeffs in self.groups:
+			if weighter_type == ConstantWeighter:
+				res[:,columns] = coeffs
+			elif weighter_type == PowerWeighter:
+				norms, exponents = coeffs
+				res[:,columns] = np.power(1 + x/norms, exponents)
+			elif weighter_type == ExponentialWeighter:
+				norms, bases = coeffs
+				res[:,columns] = np.power(bases, x/norms)
+			else:
+				norms, variances = coeffs
+				val = x / norms
+				res[:,columns] = (1.0/variances) * val * np.exp(-1.0 * val**2 / (2*variances))
+		for j in self.custom_columns:
+			res[:,j] = [self.weight_funcs[j].weight(delta) for delta in x[:,0]]
+		return res[0] if is_scalar else res
+
+	def get_exponential_decay_rates(self):
+		"""Return the vector of decay rates 'r' for which weight(x) = exp(-r*x). It is only defined if every parameter uses ExponentialWeighter."""
+		if any(type(wf) != ExponentialWeighter for wf in self.weight_funcs):
+			raise RuntimeError("Every weight function must be an ExponentialWeighter!")
+		return np.array([-np.log(wf.base) / wf.norm for wf in self.weight_funcs])
+
+	def __len__(self):
+		return self.num_of_params
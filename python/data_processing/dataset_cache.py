@@ -0,0 +1,118 @@
+import numpy as np
+import json, hashlib, os, shutil, sys
+
+sys.path.insert(0,"../")
+from simulator_utils.graph_extractor import store_edges, iter_csv_chunks
+from .tennis_player_processing import load_dataset_parameters
+
+DATASET_CACHE_VERSION = 1
+CACHE_ARRAYS = ["time", "src", "trg", "node_ids", "epochs", "epoch_offsets"]
+
+### source fingerprint ###
+
+def get_file_hash(file_path, block_size=1<<20):
+    """Return the SHA-1 hash of the file content"""
+    h = hashlib.sha1()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def get_source_hash(file_path, cache_dir):
+    """Return the hash of the source file. The hash is stored together with the size and modification time of the file, so it is only recomputed if the file has changed."""
+    stat = os.stat(file_path)
+    fingerprint = {"size":stat.st_size, "mtime":stat.st_mtime}
+    hash_file = "%s/%s.sha1.json" % (cache_dir, os.path.basename(file_path))
+    if os.path.exists(hash_file):
+        with open(hash_file) as f:
+            stored = json.load(f)
+        if stored["size"] == fingerprint["size"] and stored["mtime"] == fingerprint["mtime"]:
+            return stored["sha1"]
+    fingerprint["sha1"] = get_file_hash(file_path)
+    with open(hash_file, "w") as f:
+        json.dump(fingerprint, f)
+    return fingerprint["sha1"]
+
+def get_cache_key(source_hash, dataset_id):
+    """The cache key depends on the source file, the parameters of the dataset and the version of the cache format"""
+    min_epoch, num_days, dates, missing_dates, time_zone, sep = load_dataset_parameters(dataset_id)
+    params = [DATASET_CACHE_VERSION, source_hash, dataset_id, min_epoch, num_days, dates, missing_dates, str(time_zone), sep]
+    return hashlib.sha1(json.dumps(params).encode("utf-8")).hexdigest()[:16]
+
+### cache ###
+
+class DatasetCache():
+    """Preprocessed edges of a dataset: time ordered 'time', 'src' and 'trg' arrays, the sorted node identifiers, the distinct timestamps ('epochs') and the offsets of their edges ('epoch_offsets')"""
+    def __init__(self, cache_path, mmap=True):
+        with open("%s/meta.json" % cache_path) as f:
+            self.meta = json.load(f)
+        if self.meta["version"] != DATASET_CACHE_VERSION:
+            raise RuntimeError("Unsupported dataset cache version: %s" % self.meta["version"])
+        self.cache_path = cache_path
+        mmap_mode = "r" if mmap else None
+        for name in CACHE_ARRAYS:
+            setattr(self, name, np.load("%s/%s.npy" % (cache_path, name), mmap_mode=mmap_mode))
+
+    def __len__(self):
+        return len(self.time)
+
+    def get_edges(self, start_idx=0, end_idx=None):
+        """Return the (time,src,trg) array of the given edge range"""
+        end_idx = len(self) if end_idx == None else end_idx
+        return np.column_stack((self.time[start_idx:end_idx], self.src[start_idx:end_idx], self.trg[start_idx:end_idx]))
+
+    def iter_edge_chunks(self, chunk_size=1000000):
+        """Yield (time,src,trg) chunks for the 'edge_chunks' parameter of 'OnlineGraphSimulator.run_with_boundaries'. Only the current chunk is read into memory."""
+        for start_idx in range(0, len(self), chunk_size):
+            yield self.get_edges(start_idx, start_idx+chunk_size)
+
+def write_dataset_cache(cache_path, data_path, dataset_id, source_hash, chunk_size=1000000):
+    """Parse the raw edge file, drop the edges before 'min_epoch' and export the preprocessed arrays"""
+    min_epoch = load_dataset_parameters(dataset_id)[0]
+    chunks = []
+    for chunk in iter_csv_chunks(data_path, chunk_size=chunk_size):
+        chunks.append(chunk[chunk[:,0] >= min_epoch])
+    data = np.concatenate(chunks) if len(chunks) > 0 else np.zeros((0,3), dtype=np.int64)
+    epochs, epoch_offsets, edges = store_edges(data, verbose=False)
+    arrays = {
+        "time":np.repeat(epochs, np.diff(epoch_offsets)),
+        "src":np.ascontiguousarray(edges[:,0]),
+        "trg":np.ascontiguousarray(edges[:,1]),
+        "node_ids":np.unique(edges),
+        "epochs":epochs,
+        "epoch_offsets":epoch_offsets
+    }
+    meta = {"version":DATASET_CACHE_VERSION, "dataset_id":dataset_id, "source":os.path.basename(data_path), "source_hash":source_hash, "min_epoch":min_epoch, "num_of_edges":len(edges), "num_of_nodes":len(arrays["node_ids"]), "num_of_epochs":len(epochs)}
+    # the cache is written into a temporary folder, so a failed export is never loaded
+    tmp_path = cache_path + ".tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    for name in CACHE_ARRAYS:
+        np.save("%s/%s.npy" % (tmp_path, name), arrays[name])
+    with open("%s/meta.json" % tmp_path, "w") as f:
+        json.dump(meta, f, indent=3)
+    os.rename(tmp_path, cache_path)
+
+def prepare_dataset(dataset_id, data_path, cache_dir, chunk_size=1000000, verbose=True):
+    """Return the path of the dataset cache. The cache is only created if it does not exist for the current source file and dataset parameters."""
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    source_hash = get_source_hash(data_path, cache_dir)
+    cache_path = "%s/%s_%s" % (cache_dir, dataset_id, get_cache_key(source_hash, dataset_id))
+    if os.path.exists(cache_path):
+        if verbose:
+            print("Dataset cache found: %s" % cache_path)
+    else:
+        write_dataset_cache(cache_path, data_path, dataset_id, source_hash, chunk_size=chunk_size)
+        if verbose:
+            print("Dataset cache was created: %s" % cache_path)
+    return cache_path
+
+def load_dataset(dataset_id, data_folder="../data", mmap=True, verbose=True):
+    """Load the preprocessed edges of the 'rg17' or 'uo17' dataset. The raw mention file is only parsed on the first call."""
+    data_path = "%s/%s_data/raw/%s_mentions.csv" % (data_folder, dataset_id, dataset_id)
+    cache_dir = "%s/%s_data/cache" % (data_folder, dataset_id)
+    dataset = DatasetCache(prepare_dataset(dataset_id, data_path, cache_dir, verbose=verbose), mmap=mmap)
+    if verbose:
+        print("%s dataset were loaded: %i edges, %i nodes, %i epochs" % (dataset_id, len(dataset), dataset.meta["num_of_nodes"], dataset.meta["num_of_epochs"]))
+    return dataset
@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 import json, datetime, sys, os
 
@@ -14,6 +15,13 @@ def epoch2date(epoch, tz_info=None):
         dt = datetime.datetime.fromtimestamp(epoch, tz=tz_info)
     return "%i-%.2i-%.2i" % (dt.year, dt.month, dt.day)
 
+def get_mentions_df(dataset, tz_info=None):
+    """Return the mentions of a preprocessed dataset (see 'dataset_cache.load_dataset') with their dates. The date is computed once for each distinct epoch."""
+    epoch_dates = [epoch2date(epoch, tz_info) for epoch in dataset.epochs.tolist()]
+    mentions_df = pd.DataFrame({"epoch":dataset.time, "src":dataset.src, "trg":dataset.trg}, columns=["epoch","src","trg"])
+    mentions_df["date"] = np.repeat(epoch_dates, np.diff(dataset.epoch_offsets))
+    return mentions_df
+
 ### Identifier mappings ###
 
 def filter_assigments(all_player_dict, schedule_name_counter, data_screen_names):
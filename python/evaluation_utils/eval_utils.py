@@ -4,16 +4,25 @@ import numpy as np
 from .correlation_computer import *
 from .ndcg_computer import *
 from .binary_eval_computer import *
+from centrality_utils.snapshot_format import get_snapshot_path, load_score_column
 
 ### Utils ###
 
 def load_score_map(input_prefix, day, epsilon=0.000000001, excluded_indices=None, restricted_indices=None):
-    """TODO: The centrality maps were pre-sorted in decreasing order???"""
+    """TODO: The centrality maps were pre-sorted in decreasing order???
+    If the .csv file is missing then the column of the prefix folder is read from the binary snapshot of the computer: '<root>/<column>/<file_prefix>' -> '<root>/<file_prefix>_<day>.bin'."""
     score_file_path = input_prefix + '_%i.csv' % day
-    if not os.path.exists(score_file_path):
+    column_folder = os.path.dirname(input_prefix)
+    snapshot_file_path = get_snapshot_path(os.path.dirname(column_folder), os.path.basename(input_prefix), day)
+    if not os.path.exists(score_file_path) and not os.path.exists(snapshot_file_path):
         raise IOError("File is missing: %s" % score_file_path)
     else:
-        scores = pd.read_csv(score_file_path, sep=" ", names=["id","score"])
+        if os.path.exists(score_file_path):
+            scores = pd.read_csv(score_file_path, sep=" ", names=["id","score"])
+        else:
+            # only the selected column is read from the binary snapshot
+            node_ids, values = load_score_column(snapshot_file_path, os.path.basename(column_folder))
+            scores = pd.DataFrame({"id":node_ids, "score":values}, columns=["id","score"])
         # filter for indices
         if restricted_indices != None:
             scores = scores[scores["id"].isin(restricted_indices)]
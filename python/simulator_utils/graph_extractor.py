@@ -1,20 +1,224 @@
 import numpy as np
+import pandas as pd
+import networkx as nx
+from collections import OrderedDict, deque
+from centrality_utils.node_registry import NodeRegistry
+from centrality_utils.edge_index import EdgeIndex
 
 def extract_vertices(edge_data):
     """Extract the nodes of the graph from its edges"""
     all_v_id = np.append(edge_data[:,1], edge_data[:,2], axis=0)
     return set(all_v_id)
 
-def store_edges(edge_data):
-    """Store edges in a dict where the keys are the edge times"""
-    time_edge_map = {}
-    for i in range(len(edge_data)):
-        current_time = edge_data[i,0]
-        if not current_time in time_edge_map:
-            time_edge_map[current_time] = []
-        time_edge_map[current_time].append(edge_data[i,1:3].tolist())
-    
-    sorted_times = sorted(time_edge_map.keys())
-    print('Number of unique epochs: ' + str(len(sorted_times)))
-    return sorted_times, time_edge_map, len(edge_data)
+def store_edges(edge_data, verbose=True):
+    """Group the edges by time without leaving NumPy. Returns the unique timestamps, the epoch offsets and the (src,trg) columns sorted by time: the edges of epoch 'k' are edges[offsets[k]:offsets[k+1]] in their original order. Sorted input is not copied."""
+    edge_data = np.asarray(edge_data)
+    times = edge_data[:,0]
+    if len(times) > 1 and np.any(times[1:] < times[:-1]):
+        order = np.argsort(times, kind="mergesort")
+        times, edges = times[order], edge_data[order,1:3]
+    else:
+        edges = edge_data[:,1:3]
+    # the times are sorted, so an epoch starts wherever the time changes
+    offsets = np.flatnonzero(np.concatenate(([True], times[1:] != times[:-1]))) if len(times) > 0 else np.zeros(0, dtype=np.int64)
+    sorted_times = times[offsets]
+    offsets = np.append(offsets, len(edge_data))
+    if verbose:
+        print('Number of unique epochs: ' + str(len(sorted_times)))
+    return sorted_times, offsets, edges
 
+def iter_array_chunks(edge_array, chunk_size=1000000):
+    """Yield consecutive chunks of a (time,src,trg) array. For memory-mapped arrays (e.g. np.load(path, mmap_mode="r")) only the current chunk is read into memory."""
+    for start_idx in range(0, len(edge_array), chunk_size):
+        yield np.asarray(edge_array[start_idx:start_idx+chunk_size])
+
+def iter_csv_chunks(file_path, chunk_size=1000000, sep=" "):
+    """Read the (time,src,trg) columns of an edge file in chunks of 'chunk_size' rows"""
+    for chunk_df in pd.read_csv(file_path, sep=sep, header=None, usecols=[0,1,2], dtype=np.int64, chunksize=chunk_size):
+        yield chunk_df.values
+
+def coalesce_links(links):
+    """Merge identical links. Returns the distinct sources, targets (in the order of their first occurrence) and the multiplicities."""
+    link_arr = np.asarray(links).reshape(-1,2)
+    unique_links, first_idx, counts = np.unique(link_arr, axis=0, return_index=True, return_counts=True)
+    order = np.argsort(first_idx, kind="mergesort")
+    return unique_links[order,0], unique_links[order,1], counts[order]
+
+class SnapshotEdges():
+    """Edges of the current snapshot. 'edges' lists them in the same order as the networkx (Multi)DiGraph of the snapshot would."""
+    def __init__(self,multigraph=True):
+        self.multigraph = multigraph
+        self.successors = OrderedDict()
+        
+    def add_edge(self,src,trg):
+        if not src in self.successors:
+            self.successors[src] = OrderedDict()
+        if not trg in self.successors:
+            self.successors[trg] = OrderedDict()
+        self.successors[src][trg] = self.successors[src].get(trg,0) + 1
+        
+    def nodes(self):
+        return list(self.successors.keys())
+        
+    def edges(self):
+        edge_list = []
+        for src, trg_counts in self.successors.items():
+            for trg, count in trg_counts.items():
+                edge_list += [(src,trg)] * (count if self.multigraph else 1)
+        return edge_list
+        
+    def clear(self):
+        self.successors.clear()
+
+    def close_snapshot(self):
+        """Called at each snapshot boundary before the computers read the snapshot"""
+        pass
+
+def merge_edge_counts(keys, counts, other_keys, other_counts):
+    """Add two sorted (edge key, multiplicity) tables. Edges with zero multiplicity are dropped."""
+    all_keys = np.concatenate((keys, other_keys))
+    merged_keys, inverse = np.unique(all_keys, return_inverse=True)
+    merged_counts = np.bincount(inverse.ravel(), weights=np.concatenate((counts, other_counts)), minlength=len(merged_keys)).astype(np.int64)
+    positive = merged_counts > 0
+    return merged_keys[positive], merged_counts[positive]
+
+class WindowGraph():
+    """CSR view of the distinct edges of an edge window. The nodes of the window are indexed from 0 to 'num_of_nodes'-1 ('node_ids' maps them to the original identifiers, 'node_indices' to the indices of the window registry that do not change between snapshots). 'indptr' and 'indices' store the out-neighbours, 'data' the multiplicity of the edges."""
+    def __init__(self,node_ids,src_indices,trg_indices,multiplicities,node_indices=None):
+        self.node_ids = node_ids
+        self.node_indices = node_indices
+        self.num_of_nodes = len(node_ids)
+        self.src_indices = src_indices
+        self.indices = trg_indices
+        self.data = multiplicities
+        self.indptr = np.concatenate(([0], np.cumsum(np.bincount(src_indices, minlength=self.num_of_nodes)))).astype(np.int64)
+
+    def __len__(self):
+        return self.num_of_nodes
+
+    def num_of_edges(self):
+        return len(self.indices)
+
+    def edges(self):
+        """Return the distinct (src,trg) pairs with the original node identifiers"""
+        return list(zip(self.node_ids[self.src_indices].tolist(), self.node_ids[self.indices].tolist()))
+
+    def to_scipy(self):
+        """Return the (src x trg) adjacency matrix of the distinct edges as a scipy.sparse.csr_matrix"""
+        import scipy.sparse as sp
+        return sp.csr_matrix((np.ones(len(self.indices)), self.indices, self.indptr), shape=(self.num_of_nodes,self.num_of_nodes))
+
+    def to_networkx(self):
+        G = nx.DiGraph()
+        G.add_nodes_from(self.node_ids.tolist())
+        G.add_edges_from(self.edges())
+        return G
+
+class EdgeWindow(SnapshotEdges):
+    """Snapshot graph that also keeps the edges of the last snapshots. The edges of each closed snapshot are stored once in a ring buffer as a sorted array of edge keys with multiplicities. For each lookback count an edge multiplicity table of the window is maintained incrementally: the newest snapshot is added and the expired one is subtracted. 'lookback_cnt'=0 means every snapshot so far (the total graph)."""
+    def __init__(self,lookback_counts,multigraph=True):
+        SnapshotEdges.__init__(self,multigraph)
+        self.lookback_counts = sorted(set(lookback_counts))
+        self.window_size = max(self.lookback_counts) if len(self.lookback_counts) > 0 else 0
+        self.registry = NodeRegistry()
+        self.snapshots = deque([])
+        empty = np.zeros(0, dtype=np.int64)
+        self.tables = dict((lookback_cnt, (empty, empty)) for lookback_cnt in self.lookback_counts)
+        self.views = {}
+
+    def get_snapshot_counts(self):
+        """Return the sorted edge keys and multiplicities of the current snapshot"""
+        src_ids, trg_ids, counts = [], [], []
+        for src, trg_counts in self.successors.items():
+            for trg, count in trg_counts.items():
+                src_ids.append(src)
+                trg_ids.append(trg)
+                counts.append(count if self.multigraph else 1)
+        # nodes are registered in the order of their first appearance
+        self.registry.add_nodes(self.nodes())
+        keys = (self.registry.get_indices(src_ids) << 32) | self.registry.get_indices(trg_ids)
+        order = np.argsort(keys)
+        return keys[order], np.array(counts, dtype=np.int64)[order]
+
+    def close_snapshot(self):
+        """Push the edges of the current snapshot into the window"""
+        keys, counts = self.get_snapshot_counts()
+        for lookback_cnt in self.lookback_counts:
+            table_keys, table_counts = merge_edge_counts(self.tables[lookback_cnt][0], self.tables[lookback_cnt][1], keys, counts)
+            if lookback_cnt > 0 and len(self.snapshots) >= lookback_cnt:
+                expired_keys, expired_counts = self.snapshots[-lookback_cnt]
+                table_keys, table_counts = merge_edge_counts(table_keys, table_counts, expired_keys, -expired_counts)
+            self.tables[lookback_cnt] = (table_keys, table_counts)
+        self.snapshots.append((keys, counts))
+        while len(self.snapshots) > self.window_size:
+            self.snapshots.popleft()
+        self.views = {}
+
+    def get_view(self,lookback_cnt):
+        """Return the WindowGraph of the last 'lookback_cnt' closed snapshots. Views are shared until the next snapshot is closed."""
+        if not lookback_cnt in self.tables:
+            raise RuntimeError("The edge window is not maintained for 'lookback_cnt'=%i!" % lookback_cnt)
+        if not lookback_cnt in self.views:
+            keys, counts = self.tables[lookback_cnt]
+            src_indices, trg_indices = keys >> 32, keys & 0xFFFFFFFF
+            # nodes of the window in the order of their registration
+            window_nodes = np.unique(np.concatenate((src_indices, trg_indices)))
+            self.views[lookback_cnt] = WindowGraph(self.registry.get_node_ids(window_nodes), np.searchsorted(window_nodes, src_indices), np.searchsorted(window_nodes, trg_indices), counts, node_indices=window_nodes)
+        return self.views[lookback_cnt]
+
+    def freeze(self,lookback_counts=None):
+        """Return a FrozenEdgeWindow with the views of the given lookback counts (every maintained lookback count by default)"""
+        lookback_counts = self.lookback_counts if lookback_counts == None else sorted(set(lookback_counts))
+        return FrozenEdgeWindow(dict((lookback_cnt, self.get_view(lookback_cnt)) for lookback_cnt in lookback_counts))
+
+class FrozenEdgeWindow():
+    """Immutable copy of the views of an EdgeWindow at a snapshot boundary. The views only hold edge arrays, so it can be sent to other processes while the EdgeWindow receives the edges of the next snapshot."""
+    def __init__(self,views):
+        self.views = views
+
+    def get_view(self,lookback_cnt):
+        if not lookback_cnt in self.views:
+            raise RuntimeError("The frozen edge window has no view for 'lookback_cnt'=%i!" % lookback_cnt)
+        return self.views[lookback_cnt]
+
+class GraphStatistics():
+    """Node and edge counters of the total and the snapshot graph. Multi-edges are counted if 'multigraph' is True, then the edge counters take O(1) memory. Counting the distinct edges exactly needs one slot per edge: they are stored in an EdgeIndex (an integer key and two int64 entries per edge instead of a set of tuples). Nodes and edges are stamped with the index of the snapshot in which they were last seen, so the snapshot counters need no sets either."""
+    def __init__(self,multigraph=True):
+        self.multigraph = multigraph
+        self.registry = NodeRegistry()
+        self.node_snapshots = self.registry.allocate(fill_value=-1, dtype=np.int64)
+        self.edge_index = None if multigraph else EdgeIndex()
+        self.edge_snapshots = None if multigraph else self.edge_index.allocate(fill_value=-1, dtype=np.int64)
+        self.snapshot_idx = 0
+        self.num_total_edges, self.num_snapshot_nodes, self.num_snapshot_edges = 0, 0, 0
+        
+    def get_node_index(self,node):
+        node_index = self.registry.get_index(node)
+        if node_index >= len(self.node_snapshots):
+            self.node_snapshots = self.registry.fit(self.node_snapshots, fill_value=-1)
+        if self.node_snapshots[node_index] != self.snapshot_idx:
+            self.node_snapshots[node_index] = self.snapshot_idx
+            self.num_snapshot_nodes += 1
+        return node_index
+        
+    def add_edge(self,src,trg):
+        src_index, trg_index = self.get_node_index(src), self.get_node_index(trg)
+        if self.multigraph:
+            self.num_total_edges += 1
+            self.num_snapshot_edges += 1
+        else:
+            edge_slot = self.edge_index.get_slot(src_index,trg_index)
+            if edge_slot >= len(self.edge_snapshots):
+                self.edge_snapshots = self.edge_index.fit(self.edge_snapshots, fill_value=-1)
+            self.num_total_edges = len(self.edge_index)
+            if self.edge_snapshots[edge_slot] != self.snapshot_idx:
+                self.edge_snapshots[edge_slot] = self.snapshot_idx
+                self.num_snapshot_edges += 1
+            
+    def clear_snapshot(self):
+        self.snapshot_idx += 1
+        self.num_snapshot_nodes, self.num_snapshot_edges = 0, 0
+        
+    def get_stats(self):
+        """Return [#total nodes, #total edges, #snapshot nodes, #snapshot edges]"""
+        return [len(self.registry), self.num_total_edges, self.num_snapshot_nodes, self.num_snapshot_edges]
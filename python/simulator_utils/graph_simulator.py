@@ -1,75 +1,210 @@
 import networkx as nx
-import sys
+import numpy as np
+import sys, multiprocessing
 sys.path.insert(0,"../")
-from centrality_utils.base_computer import BaseComputer
-from .graph_extractor import store_edges
+from centrality_utils.base_computer import BaseComputer, get_snapshot_writer, SNAPSHOT_EDGES, FULL_GRAPH, EDGE_WINDOW
+from .graph_extractor import store_edges, coalesce_links, SnapshotEdges, EdgeWindow, GraphStatistics
+from .static_pipeline import StaticPipeline
+from .shared_edge_buffer import SharedEdgeBuffer, receive_from_workers
+
+def _run_worker(settings, computers, boundaries, experiment_folder, max_index, edge_buffer, connection, snapshot_barrier):
+    """Simulate the computers of one group in a worker process. The stats and the final state of the computers are sent back at the end of the stream."""
+    edge_chunks = edge_buffer.iter_chunks(connection)
+    try:
+        simulator = OnlineGraphSimulator(**settings)
+        simulator.snapshot_barrier = snapshot_barrier
+        experiment_graph_stats = simulator.run_with_boundaries(computers, boundaries, experiment_folder, max_index=max_index, edge_chunks=edge_chunks)
+        # the slots of the remaining chunks are released for the other workers
+        for edge_chunk in edge_chunks:
+            pass
+        connection.send((experiment_graph_stats, computers))
+    except Exception as e:
+        # the error is sent before the other workers fail at the broken barrier
+        connection.send(e)
+        if snapshot_barrier != None:
+            snapshot_barrier.abort()
 
 class OnlineGraphSimulator(BaseComputer):
-    def __init__(self,graph_array,time_type="epoch",verbose=False):
-        """Graph simulator for calculating centrality scores in each snapshot. Use 'time_type'='epoch' if the elapsed time is measures in seconds, or 'time_type'='index' if the elapsed time is measures in the number of edges."""
-        timestamps, edge_map, num_edges = store_edges(graph_array)
+    def __init__(self,graph_array=None,time_type="epoch",verbose=False,coalesce=False,snapshot_format=None,write_threads=0,max_pending_snapshots=4,pipeline_static=False,max_in_flight_snapshots=2):
+        """Graph simulator for calculating centrality scores in each snapshot. 'graph_array' can be None if the edges are streamed to 'run_with_boundaries' in chunks. Use 'time_type'='epoch' if the elapsed time is measures in seconds, or 'time_type'='index' if the elapsed time is measures in the number of edges. If 'coalesce'=True then coalescable computers receive the edges of each timestamp in one batch with multiplicities (only for 'epoch' time type). Set 'snapshot_format' to 'csv' or 'binary' to override the snapshot writer of every computer. If 'write_threads' is positive then the snapshots are serialized by that many background threads (at most 'max_pending_snapshots' snapshots are queued), and every file is written when 'run_with_boundaries' returns. If 'pipeline_static'=True then the snapshots of pipelinable computers (static measures) are computed in worker processes from frozen edge windows while the simulation continues (see StaticPipeline), at most 'max_in_flight_snapshots' snapshots at once."""
         if time_type not in ["index","epoch"]:
             raise RuntimeError("Invalid time_type")
+        if coalesce and time_type != "epoch":
+            raise RuntimeError("Coalesced updates are only supported with 'time_type'='epoch'!")
         self.verbose = verbose
         self.time_type = time_type
-        self.timestamps = sorted(timestamps)
-        self.edge_map = edge_map
-        self.num_edges = num_edges
+        self.coalesce = coalesce
+        if write_threads > 0 and snapshot_format == None:
+            snapshot_format = "csv"
+        self.score_writer = None if snapshot_format == None else get_snapshot_writer(snapshot_format,num_of_threads=write_threads,max_pending=max_pending_snapshots)
+        self.pipeline_static = pipeline_static
+        self.max_in_flight_snapshots = max_in_flight_snapshots
+        self.pipeline = None
+        # settings of the simulators of the worker processes (see 'run_in_parallel')
+        self.settings = dict(time_type=time_type, verbose=verbose, coalesce=coalesce, snapshot_format=snapshot_format, write_threads=write_threads, max_pending_snapshots=max_pending_snapshots, pipeline_static=pipeline_static, max_in_flight_snapshots=max_in_flight_snapshots)
+        self.snapshot_barrier = None
+        self.timestamps, self.epoch_offsets, self.edges = None, None, None
+        if graph_array is not None:
+            self.set_edge_block(graph_array)
+        
+    def set_edge_block(self, edge_block, verbose=True):
+        """Group the edges of the (time,src,trg) array by time. The simulator processes them as the next block of the stream."""
+        self.timestamps, self.epoch_offsets, self.edges = store_edges(edge_block, verbose=verbose)
+        
+    def iter_edge_blocks(self, edge_chunks=None):
+        """Iterate over blocks of complete epochs. Yields whether the current block is the last one. Without 'edge_chunks' the edges given to the constructor form one block. Otherwise 'edge_chunks' must yield time ordered (time,src,trg) arrays: the edges of the last timestamp of each chunk are carried over to the next chunk, so epochs are never split, and only the current chunk is kept in memory."""
+        if edge_chunks is None:
+            if self.edges is None:
+                raise RuntimeError("No edges were given: pass 'graph_array' to the constructor or 'edge_chunks' to 'run_with_boundaries'!")
+            yield True
+            return
+        last_epoch = None
+        for chunk in edge_chunks:
+            chunk = np.asarray(chunk)
+            if len(chunk) == 0:
+                continue
+            if np.any(chunk[1:,0] < chunk[:-1,0]) or (last_epoch is not None and chunk[0,0] < last_epoch[-1,0]):
+                raise RuntimeError("The edge chunks must be ordered by time!")
+            if last_epoch is not None:
+                chunk = np.concatenate((last_epoch, chunk))
+            split_idx = np.searchsorted(chunk[:,0], chunk[-1,0], side="left")
+            last_epoch = chunk[split_idx:]
+            if split_idx > 0:
+                self.set_edge_block(chunk[:split_idx], verbose=False)
+                yield False
+        self.set_edge_block(np.zeros((0,3), dtype=np.int64) if last_epoch is None else last_epoch, verbose=False)
+        yield True
+        
+    def init_graphs(self, score_computers, multigraph):
+        """Build only the graph structures that the computers require. 'self.graph' is a networkx graph if any computer needs the full graph and None otherwise. The returned snapshot graph is an EdgeWindow (shared by the computers that read the last snapshots), SnapshotEdges or None if no computer needs the snapshot edges."""
+        requirements, lookback_counts = set(), set()
+        for comp in score_computers:
+            requirements.update(comp.get_graph_requirements())
+            lookback_counts.update(comp.get_lookback_counts())
+        if FULL_GRAPH in requirements:
+            self.graph = nx.MultiDiGraph() if multigraph else nx.DiGraph()
+        else:
+            self.graph = None
+        self.graph_stats = GraphStatistics(multigraph)
+        if EDGE_WINDOW in requirements:
+            return EdgeWindow(lookback_counts, multigraph)
+        return SnapshotEdges(multigraph) if SNAPSHOT_EDGES in requirements else None
+        
+    def add_edge(self, link, snapshot_graph):
+        if self.graph != None:
+            self.graph.add_edge(link[0],link[1])
+        if snapshot_graph != None:
+            snapshot_graph.add_edge(link[0],link[1])
+        self.graph_stats.add_edge(link[0],link[1])
+        
+    def add_edges(self, links, snapshot_graph):
+        """Add the links of an epoch to the graphs at once"""
+        for link in links:
+            self.add_edge(link, snapshot_graph)
+        
+    def init_update_groups(self, score_computers):
+        """Computers that read no graph receive the links of an epoch with one 'update_many' call, the others are updated after each link (coalescable computers are updated at the end of the epoch in coalesced mode)."""
+        self.coalesced_computers, self.batch_computers, self.link_computers = [], [], []
+        for comp in score_computers:
+            if self.coalesce and comp.coalescable:
+                self.coalesced_computers.append(comp)
+            elif len(comp.get_graph_requirements()) == 0:
+                self.batch_computers.append(comp)
+            else:
+                self.link_computers.append(comp)
+        
+    def init_pipeline(self, score_computers):
+        """Return a StaticPipeline for the pipelinable computers if 'pipeline_static' is set (None otherwise)"""
+        pipelined_computers = [comp for comp in score_computers if comp.pipelinable]
+        if not self.pipeline_static or len(pipelined_computers) == 0:
+            return None
+        return StaticPipeline(pipelined_computers, max_in_flight=self.max_in_flight_snapshots)
         
     def take_snapshot(self, interval_id, current_time, score_computers, experiment_folder, snapshot_graph):
         """When a snapshot boundary is reached in the simulation, the simulator will export the current centrality scores to files."""
-        total_num_nodes, total_num_edges, snapshot_num_nodes, snapshot_num_edges = len(self.graph.nodes()), len(self.graph.edges()), len(snapshot_graph.nodes()), len(snapshot_graph.edges())
+        total_num_nodes, total_num_edges, snapshot_num_nodes, snapshot_num_edges = self.graph_stats.get_stats()
+        if snapshot_graph != None:
+            snapshot_graph.close_snapshot()
         # export original centrality scores
-        for comp in score_computers:
+        inline_computers = score_computers
+        if self.pipeline != None:
+            self.pipeline.submit(interval_id, current_time, snapshot_graph, experiment_folder+"/original")
+            inline_computers = [comp for comp in score_computers if not comp in self.pipeline.computers]
+            if self.snapshot_barrier != None or any(comp.reads_snapshot_files() for comp in inline_computers):
+                # the files of the pipelined computers must be written before they are read
+                self.pipeline.wait()
+        if self.snapshot_barrier != None:
+            # computers of other worker processes may read the files of this snapshot
+            readers = [comp for comp in inline_computers if comp.reads_snapshot_files()]
+            for comp in inline_computers:
+                if not comp in readers:
+                    comp.save_snapshot(experiment_folder+"/original", interval_id, time=current_time, graph=self.graph, snapshot_graph=snapshot_graph)
+                    comp.snapshot_writer.wait()
+            self.snapshot_barrier.wait()
+            inline_computers = readers
+        for comp in inline_computers:
             comp.save_snapshot(experiment_folder+"/original", interval_id, time=current_time, graph=self.graph, snapshot_graph=snapshot_graph)
         print("Snapshot processed: interval_id=%i, boundary=%i" % (interval_id, current_time))
         if self.verbose:
             print("   Total graph: #nodes=%i, #edges=%i" % (total_num_nodes, total_num_edges))
             print("   Snapshot graph: #nodes=%i, #edges=%i" % (snapshot_num_nodes, snapshot_num_edges))
-        snapshot_graph.clear()
+        if snapshot_graph != None:
+            snapshot_graph.clear()
+        self.graph_stats.clear_snapshot()
         return [total_num_nodes, total_num_edges, snapshot_num_nodes, snapshot_num_edges]
         
-    def update_for_epoch(self, score_computers, timestamp, snapshot_graph):
-        """Update score computers with all links in the current epoch"""
-        for link in self.edge_map[timestamp]:
-            self.graph.add_edge(link[0],link[1])
-            snapshot_graph.add_edge(link[0],link[1])
-            # update scores
-            for comp in score_computers:
-                comp.update(link, time=timestamp, graph=self.graph, snapshot_graph=snapshot_graph)
+    def update_for_epoch(self, score_computers, epoch_idx, snapshot_graph):
+        """Update score computers with all links in the current epoch (see 'init_update_groups')"""
+        timestamp = self.timestamps[epoch_idx]
+        epoch_edges = self.edges[self.epoch_offsets[epoch_idx]:self.epoch_offsets[epoch_idx+1]]
+        links = epoch_edges.tolist()
+        if len(self.link_computers) > 0:
+            for link in links:
+                self.add_edge(link, snapshot_graph)
+                # update scores
+                for comp in self.link_computers:
+                    comp.update(link, time=timestamp, graph=self.graph, snapshot_graph=snapshot_graph)
+        else:
+            self.add_edges(links, snapshot_graph)
+        for comp in self.batch_computers:
+            comp.update_many(epoch_edges[:,0], epoch_edges[:,1], time=timestamp, graph=self.graph, snapshot_graph=snapshot_graph)
+        if len(self.coalesced_computers) > 0:
+            src_ids, trg_ids, multiplicities = coalesce_links(epoch_edges)
+            for comp in self.coalesced_computers:
+                comp.update_coalesced(src_ids, trg_ids, multiplicities, time=timestamp, graph=self.graph, snapshot_graph=snapshot_graph)
         
-    def _run_with_epoch_boundaries(self, score_computers, boundaries, experiment_folder, max_index=None):
-        """'boundaries' must contain integers, which represent epochs. These will be the score evaluation barriers."""
+    def _run_with_epoch_boundaries(self, score_computers, boundaries, experiment_folder, max_index=None, edge_chunks=None):
+        """'boundaries' must contain integers, which represent epochs. These will be the score evaluation barriers. An epoch equal to the boundary belongs to the snapshot, except when it is the first epoch after an empty interval."""
         print("'run_with_epoch_boundaries' will be executed!")
-        num_epochs = len(self.timestamps)
-        prev_epoch, current_epoch = -1, 0
+        boundaries = np.asarray(boundaries)
+        current_epoch = 0
         interval_id = 0
-        terminate_loop = False
-        self.graph = nx.MultiDiGraph()
-        snapshot_graph = nx.MultiDiGraph()
+        snapshot_graph = self.init_graphs(score_computers, multigraph=True)
+        self.init_update_groups(score_computers)
         experiment_graph_stats = []
-        for epoch_idx in range(num_epochs):
-            current_epoch = self.timestamps[epoch_idx]
-            is_updated = False
-            if current_epoch <= boundaries[interval_id]:
-                self.update_for_epoch(score_computers, current_epoch, snapshot_graph)
-                is_updated = True
-            # handle inactive intervals (when there is no edge in the interval)
-            while (not terminate_loop) and current_epoch >= boundaries[interval_id]:
-                # NOTE: the last incomplete interval snapshot will not be saved!!! We should inspect whether we are at the last epoch in data!!!
-                if (max_index != None and interval_id >= max_index-1) or interval_id == len(boundaries)-1:
-                    terminate_loop = True
-                if terminate_loop or (current_epoch >= boundaries[interval_id] and prev_epoch < boundaries[interval_id]):
+        for is_last_block in self.iter_edge_blocks(edge_chunks):
+            for epoch_idx in range(len(self.timestamps)):
+                current_epoch = self.timestamps[epoch_idx]
+                if current_epoch < boundaries[interval_id]:
+                    self.update_for_epoch(score_computers, epoch_idx, snapshot_graph)
+                    continue
+                is_updated = False
+                if current_epoch == boundaries[interval_id]:
+                    self.update_for_epoch(score_computers, epoch_idx, snapshot_graph)
+                    is_updated = True
+                # snapshots of every boundary that is passed by this epoch (inactive intervals have no edges)
+                last_interval_id = np.searchsorted(boundaries, current_epoch, side="right") - 1
+                while interval_id <= last_interval_id:
+                    # NOTE: the last incomplete interval snapshot will not be saved!!! We should inspect whether we are at the last epoch in data!!!
+                    terminate_loop = (max_index != None and interval_id >= max_index-1) or interval_id == len(boundaries)-1
                     snapshot_graph_stats = self.take_snapshot(interval_id, boundaries[interval_id], score_computers, experiment_folder, snapshot_graph)
                     experiment_graph_stats.append(snapshot_graph_stats)
                     if terminate_loop:
                         print("Termination: interval_id=%i" % interval_id)
                         return experiment_graph_stats
                     interval_id += 1
-            if not is_updated:
-                self.update_for_epoch(score_computers, current_epoch, snapshot_graph)         
-                is_updated = True
-            prev_epoch = current_epoch
+                if not is_updated:
+                    self.update_for_epoch(score_computers, epoch_idx, snapshot_graph)
         # save last snapshot if all links have been prosessed
         if interval_id > 1 and current_epoch > boundaries[interval_id-1] and current_epoch < boundaries[interval_id]:
             snapshot_graph_stats = self.take_snapshot(interval_id, boundaries[interval_id], score_computers, experiment_folder, snapshot_graph)
@@ -77,44 +212,109 @@ class OnlineGraphSimulator(BaseComputer):
             print("Termination: idx=%i. All links have been prosessed!" % interval_id)
         return experiment_graph_stats
         
-    def _run_with_edge_boundaries(self, score_computers, boundaries, experiment_folder, max_index=None):
+    def _run_with_edge_boundaries(self, score_computers, boundaries, experiment_folder, max_index=None, edge_chunks=None):
         """'boundaries' must contain integers, which represent edge indices. These will be the score evaluation barriers."""
         print("'run_with_edge_boundaries' will be executed!")
-        num_epochs = len(self.timestamps)
         edge_idx = 1
+        num_edges = None
         interval_id = 0
         terminate_loop = False
-        self.graph = nx.DiGraph()
-        snapshot_graph = nx.DiGraph()
+        snapshot_graph = self.init_graphs(score_computers, multigraph=False)
         experiment_graph_stats = []
-        for epoch_idx in range(num_epochs):
-            timestamp = self.timestamps[epoch_idx]
-            for link in self.edge_map[timestamp]:
-                self.graph.add_edge(link[0],link[1])
-                snapshot_graph.add_edge(link[0],link[1])
-                # update scores
-                for comp in score_computers:
-                    comp.update(link,time=edge_idx,graph=self.graph,snapshot_graph=snapshot_graph)
-                if (max_index != None and edge_idx >= max_index) or (interval_id == len(boundaries)-1 and edge_idx == boundaries[-1]) or edge_idx == self.num_edges:
-                    terminate_loop = True
-                # take snapshot
-                if terminate_loop or edge_idx == boundaries[interval_id]:
-                    snapshot_graph_stats = self.take_snapshot(interval_id, boundaries[interval_id], score_computers, experiment_folder, snapshot_graph)
-                    experiment_graph_stats.append(snapshot_graph_stats)
-                    if terminate_loop:
-                        print("Termination: interval_id=%i" % interval_id)
-                        return experiment_graph_stats
-                    interval_id += 1
-                edge_idx += 1
+        for is_last_block in self.iter_edge_blocks(edge_chunks):
+            if is_last_block:
+                # the index of the last edge is only known in the last block of a stream
+                num_edges = edge_idx - 1 + len(self.edges)
+            for epoch_idx in range(len(self.timestamps)):
+                for link in self.edges[self.epoch_offsets[epoch_idx]:self.epoch_offsets[epoch_idx+1]].tolist():
+                    self.add_edge(link, snapshot_graph)
+                    # update scores
+                    for comp in score_computers:
+                        comp.update(link,time=edge_idx,graph=self.graph,snapshot_graph=snapshot_graph)
+                    if (max_index != None and edge_idx >= max_index) or (interval_id == len(boundaries)-1 and edge_idx == boundaries[-1]) or edge_idx == num_edges:
+                        terminate_loop = True
+                    # take snapshot
+                    if terminate_loop or edge_idx == boundaries[interval_id]:
+                        snapshot_graph_stats = self.take_snapshot(interval_id, boundaries[interval_id], score_computers, experiment_folder, snapshot_graph)
+                        experiment_graph_stats.append(snapshot_graph_stats)
+                        if terminate_loop:
+                            print("Termination: interval_id=%i" % interval_id)
+                            return experiment_graph_stats
+                        interval_id += 1
+                    edge_idx += 1
         return experiment_graph_stats
                 
-    def run_with_boundaries(self,score_computers,boundaries,experiment_folder,max_index=None):
-        """'boundaries' must contain integers. Simulation is based on 'time_type' parameter of this object!!!"""
+    def run_with_boundaries(self,score_computers,boundaries,experiment_folder,max_index=None,edge_chunks=None):
+        """'boundaries' must contain integers. Simulation is based on 'time_type' parameter of this object!!! Set 'edge_chunks' to an iterator of time ordered (time,src,trg) arrays (e.g. 'iter_csv_chunks' or 'iter_array_chunks' of graph_extractor) to stream the edges instead of using the array of the constructor. The snapshots are the same in both cases."""
         for i in range(len(score_computers)):
             if not isinstance(score_computers[i],BaseComputer):
                 raise RuntimeError("The %ith computer does NOT extend BaseComputer!" % (i+1))
-        if self.time_type == "index":
-            experiment_graph_stats = self._run_with_edge_boundaries(score_computers, boundaries, experiment_folder, max_index=max_index)
-        else:
-            experiment_graph_stats = self._run_with_epoch_boundaries(score_computers, boundaries, experiment_folder, max_index=max_index)
+            if self.score_writer != None:
+                score_computers[i].set_snapshot_writer(self.score_writer)
+        self.pipeline = self.init_pipeline(score_computers)
+        try:
+            if self.time_type == "index":
+                experiment_graph_stats = self._run_with_edge_boundaries(score_computers, boundaries, experiment_folder, max_index=max_index, edge_chunks=edge_chunks)
+            else:
+                experiment_graph_stats = self._run_with_epoch_boundaries(score_computers, boundaries, experiment_folder, max_index=max_index, edge_chunks=edge_chunks)
+            if self.pipeline != None:
+                self.pipeline.close()
+        finally:
+            if self.pipeline != None:
+                self.pipeline.terminate()
+                self.pipeline = None
+            for comp in score_computers:
+                comp.close()
+            # barrier: wait for the pending snapshot writes of every computer
+            snapshot_writers = []
+            for comp in score_computers:
+                if not any(comp.snapshot_writer is writer for writer in snapshot_writers):
+                    snapshot_writers.append(comp.snapshot_writer)
+            for writer in snapshot_writers:
+                writer.close()
         return experiment_graph_stats
+        
+    def run_in_parallel(self,score_computers,boundaries,experiment_folder,max_index=None,edge_chunks=None,groups=None,chunk_size=1000000,num_of_slots=4):
+        """Run 'run_with_boundaries' for groups of computers in parallel worker processes ('groups' is a list of computer lists, each computer runs in its own process by default). The workers build the graph structures of their own computers and read the same edge chunks from a SharedEdgeBuffer of 'num_of_slots' slots of 'chunk_size' edges. If any computer reads the snapshot files of other computers (e.g. batch scores of DecayedIndegreeComputer), the workers meet at a barrier in each snapshot after their other files are written. The snapshots are the same as with 'run_with_boundaries'. The computers are updated to their final state in the worker processes (copies of a shared NodeRegistry are no longer shared)."""
+        groups = [[comp] for comp in score_computers] if groups == None else groups
+        for i in range(len(groups)):
+            for comp in groups[i]:
+                if not isinstance(comp,BaseComputer):
+                    raise RuntimeError("A computer of the %ith group does NOT extend BaseComputer!" % (i+1))
+        if edge_chunks is None:
+            if self.edges is None:
+                raise RuntimeError("No edges were given: pass 'graph_array' to the constructor or 'edge_chunks' to 'run_in_parallel'!")
+            edge_chunks = [np.column_stack((np.repeat(self.timestamps, np.diff(self.epoch_offsets)), self.edges))]
+        edge_buffer = SharedEdgeBuffer(len(groups), chunk_size=chunk_size, num_of_slots=num_of_slots)
+        reads_snapshot_files = any(comp.reads_snapshot_files() for group in groups for comp in group)
+        snapshot_barrier = multiprocessing.Barrier(len(groups)) if reads_snapshot_files and len(groups) > 1 else None
+        processes, connections = [], []
+        try:
+            for group in groups:
+                parent_connection, child_connection = multiprocessing.Pipe()
+                # non-daemonic workers, so the computers may start their own processes
+                process = multiprocessing.Process(target=_run_worker, args=(self.settings, group, boundaries, experiment_folder, max_index, edge_buffer, child_connection, snapshot_barrier))
+                process.start()
+                child_connection.close()
+                processes.append(process)
+                connections.append(parent_connection)
+            for edge_chunk in edge_chunks:
+                edge_buffer.put(edge_chunk, connections)
+            edge_buffer.close(connections)
+            results = {}
+            while len(results) < len(groups):
+                results.update(receive_from_workers([conn for conn in connections if not conn in results]))
+            for process in processes:
+                process.join()
+        finally:
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+                    process.join()
+            for connection in connections:
+                connection.close()
+        # copy the final state of the workers' computers
+        for group, connection in zip(groups, connections):
+            for comp, worker_comp in zip(group, results[connection][1]):
+                comp.copy_state(worker_comp)
+        return results[connections[0]][0]
@@ -0,0 +1,78 @@
+import ctypes
+from threading import BrokenBarrierError
+import numpy as np
+from multiprocessing import RawArray, Semaphore
+from multiprocessing.connection import wait
+
+class SharedEdgeBuffer():
+    """Ring of 'num_of_slots' shared memory slots of at most 'chunk_size' (time,src,trg) rows. The simulator process copies each edge chunk into the next slot and sends its (slot,length) to every worker process over its connection. Workers copy the chunk out and release the slot, so a slot is reused only after every worker has read it."""
+    def __init__(self,num_of_workers,chunk_size=1000000,num_of_slots=4):
+        if chunk_size < 1 or num_of_slots < 1:
+            raise RuntimeError("'chunk_size' and 'num_of_slots' must be positive!")
+        self.num_of_workers = num_of_workers
+        self.chunk_size = chunk_size
+        self.slots = [RawArray(ctypes.c_int64, 3*chunk_size) for i in range(num_of_slots)]
+        self.released = [Semaphore(0) for i in range(num_of_slots)]
+        self.is_used = [False] * num_of_slots
+        self.next_slot = 0
+
+    def _acquire_slot(self,slot,connections):
+        """Wait until every worker has released the slot. Workers only send messages before the end of the stream if they failed."""
+        for i in range(self.num_of_workers):
+            while not self.released[slot].acquire(timeout=0.1):
+                if len(receive_from_workers(connections, timeout=0)) > 0:
+                    raise RuntimeError("Unexpected message from a worker process!")
+
+    def _send(self,message,connections):
+        for connection in connections:
+            try:
+                connection.send(message)
+            except OSError:
+                # the worker has stopped: raise its error if it sent one
+                receive_from_workers(connections, timeout=0)
+                raise RuntimeError("A worker process stopped unexpectedly!")
+
+    def put(self,edge_chunk,connections):
+        """Send a (time,src,trg) chunk to the workers. Chunks longer than 'chunk_size' are split."""
+        edge_chunk = np.asarray(edge_chunk, dtype=np.int64).reshape(-1,3)
+        for start_idx in range(0, len(edge_chunk), self.chunk_size):
+            part = edge_chunk[start_idx:start_idx+self.chunk_size]
+            slot = self.next_slot
+            if self.is_used[slot]:
+                self._acquire_slot(slot, connections)
+            np.frombuffer(self.slots[slot], dtype=np.int64)[:3*len(part)] = part.ravel()
+            self.is_used[slot] = True
+            self._send((slot, len(part)), connections)
+            self.next_slot = (slot + 1) % len(self.slots)
+
+    def close(self,connections):
+        """Signal the end of the stream"""
+        self._send(None, connections)
+
+    def iter_chunks(self,connection):
+        """Worker side: yield the chunks of the stream in order"""
+        while True:
+            task = connection.recv()
+            if task == None:
+                return
+            slot, length = task
+            edge_chunk = np.frombuffer(self.slots[slot], dtype=np.int64)[:3*length].reshape(length,3).copy()
+            self.released[slot].release()
+            yield edge_chunk
+
+def receive_from_workers(connections, timeout=None):
+    """Return the messages of the worker processes that are ready within 'timeout' seconds by connection. Errors sent by the workers are raised: a broken snapshot barrier is only reported if no worker sent the error that caused it."""
+    messages, errors = {}, []
+    for connection in wait(connections, timeout=timeout):
+        try:
+            message = connection.recv()
+        except (EOFError, OSError):
+            message = RuntimeError("A worker process stopped unexpectedly!")
+        if isinstance(message, Exception):
+            errors.append(message)
+        else:
+            messages[connection] = message
+    if len(errors) > 0:
+        errors.sort(key=lambda error: isinstance(error, BrokenBarrierError))
+        raise errors[0]
+    return messages
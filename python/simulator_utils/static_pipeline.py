@@ -0,0 +1,88 @@
+import multiprocessing
+from collections import deque
+
+def _run_computer(computer, connection):
+    """Worker loop: compute the snapshot of each received (interval_id,time,frozen_window) task. The final state of the computer is sent back when the task is None."""
+    while True:
+        task = connection.recv()
+        if task == None:
+            computer.close()
+            connection.send(computer)
+            connection.close()
+            return
+        interval_id, time, snapshot_graph = task
+        try:
+            snapshot = computer.get_snapshot(time=time, snapshot_graph=snapshot_graph)
+        except Exception as e:
+            snapshot = e
+        connection.send((interval_id, snapshot))
+
+class StaticPipeline():
+    """Compute the snapshots of pipelinable computers (e.g. static PageRank, harmonic centrality, indegree and NBM) in worker processes while the simulator streams the edges of the next interval. Each computer lives in its own worker process, so its state (e.g. warm start vectors) is kept between snapshots. The workers receive a FrozenEdgeWindow of each snapshot. At most 'max_in_flight' snapshots are computed at once, and the results are written in the order of the snapshots by the snapshot writers of the computers."""
+    def __init__(self,computers,max_in_flight=2):
+        if max_in_flight < 1:
+            raise RuntimeError("'max_in_flight' must be positive!")
+        self.computers = computers
+        self.max_in_flight = max_in_flight
+        self.lookback_counts = set()
+        for comp in computers:
+            self.lookback_counts.update(comp.get_lookback_counts())
+        self.workers = []
+        # (interval_id, experiment_folder) of the submitted snapshots
+        self.in_flight = deque([])
+
+    def start(self):
+        for comp in self.computers:
+            parent_connection, child_connection = multiprocessing.Pipe()
+            # non-daemonic workers, so the computers may start their own process pools
+            process = multiprocessing.Process(target=_run_computer, args=(comp, child_connection))
+            process.start()
+            child_connection.close()
+            self.workers.append((process, parent_connection))
+
+    def submit(self,interval_id,time,snapshot_graph,experiment_folder):
+        """Send the frozen views of the closed snapshot to every worker. Blocks while 'max_in_flight' snapshots are computed."""
+        if len(self.workers) == 0:
+            self.start()
+        while len(self.in_flight) >= self.max_in_flight:
+            self.collect()
+        frozen_window = snapshot_graph.freeze(self.lookback_counts)
+        for process, connection in self.workers:
+            connection.send((interval_id, time, frozen_window))
+        self.in_flight.append((interval_id, experiment_folder))
+
+    def collect(self):
+        """Wait for the oldest submitted snapshot of every worker and write it"""
+        interval_id, experiment_folder = self.in_flight.popleft()
+        for comp, (process, connection) in zip(self.computers, self.workers):
+            result_id, snapshot = connection.recv()
+            if isinstance(snapshot, Exception):
+                raise snapshot
+            if result_id != interval_id:
+                raise RuntimeError("Snapshot %i was received instead of snapshot %i!" % (result_id, interval_id))
+            if snapshot != None:
+                comp.snapshot_writer.write(snapshot, experiment_folder, interval_id)
+
+    def wait(self):
+        """Write every submitted snapshot"""
+        while len(self.in_flight) > 0:
+            self.collect()
+
+    def close(self):
+        """Write the pending snapshots, stop the workers and copy their final state into the computers"""
+        self.wait()
+        for comp, (process, connection) in zip(self.computers, self.workers):
+            connection.send(None)
+            comp.copy_state(connection.recv())
+            process.join()
+        self.terminate()
+
+    def terminate(self):
+        """Stop the workers without waiting for their results (e.g. after an error)"""
+        for process, connection in self.workers:
+            if process.is_alive():
+                process.terminate()
+                process.join()
+            connection.close()
+        self.workers = []
+        self.in_flight.clear()